@@ -6,12 +6,17 @@ from io import BytesIO
 from uuid import uuid4
 
 from constants import DATABASE_NAME, DEV_ID
+from crawler import stale_crawler
+from egress_pool import egress_pool
 from helpers import (
     convert_makrs_to_md_file,
     get_session,
     init_database,
 )
+from lookup_coordinator import lookup_coordinator
 from models import Season
+from notifier import notifier
+from number_index import number_index
 from queries import (
     db_delete_all_marks,
     db_delete_all_students,
@@ -21,14 +26,24 @@ from queries import (
     get_all_users,
     get_marks_by_subject,
     get_student,
+    get_students_validity,
     get_subject_by_name,
     get_user_from_db,
 )
 from pdf_maker import convert_marks_to_pdf_file
+from sentinel_detector import sentinel_detector
 from telegram import Message, Update
 from telegram.constants import ParseMode
 from telegram.error import TelegramError
 from telegram.ext import ContextTypes, ConversationHandler
+from watch_registry import watch_registry
+from web_scrapper import (
+    concurrency_controller,
+    exam_site_breaker,
+    hedge_stats,
+    request_scheduler,
+    response_cache,
+)
 
 
 def verify_admin(func):
@@ -136,6 +151,55 @@ async def exec_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@verify_admin
+async def scraper_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = concurrency_controller.stats()
+    scheduler_stats = request_scheduler.stats()
+    crawler_stats = stale_crawler.stats()
+    sentinel_stats = sentinel_detector.stats()
+    output = (
+        "concurrency window: {window}".format(**stats),
+        "in use: {in_use} {in_use_by_priority}".format(**scheduler_stats),
+        "waiting: {waiting}".format(**scheduler_stats),
+        "latency: {latency_ewma}s (ewma), {latency_p95}s (p95)".format(**stats),
+        "error rate: {error_rate}".format(**stats),
+        "circuit breaker: {}".format(exam_site_breaker.state),
+        "hedged requests: {sent} sent, {won} won".format(**hedge_stats),
+        "response cache: {} pages, {} hits, {} misses".format(
+            len(response_cache), response_cache.hits, response_cache.misses
+        ),
+        "numbers index: {valid} valid, {invalid} invalid, {unknown} unknown".format(
+            **number_index.counts()
+        ),
+        "crawler: {updated} updated, {no_changes} without changes, "
+        "{failed} failed".format(**crawler_stats["total"]),
+        "crawler last run: {updated} updated, {no_changes} without changes, "
+        "{failed} failed in {elapsed:.1f}s".format(**crawler_stats["last_run"]),
+        "lookups: {} requested, {} coalesced".format(
+            lookup_coordinator.requested_numbers, lookup_coordinator.coalesced_numbers
+        ),
+        "sentinels: {sentinels} probed, {detections} detections, "
+        "{queued_sweeps} queued sweeps".format(**sentinel_stats),
+        "last sweep: {updated} updated, {no_changes} without changes, "
+        "{failed} failed in {elapsed:.1f}s".format(**sentinel_stats["last_sweep"]),
+        "notifications: {} sent, {} failed, {} pending".format(
+            notifier.sent, notifier.failed, notifier.pending
+        ),
+        "danger mode: {} users watching {} numbers, polling every {:.1f}s".format(
+            watch_registry.subscribers_count,
+            len(watch_registry),
+            watch_registry.interval(),
+        ),
+    )
+    if egress_pool is not None:
+        output += tuple(
+            "route {route}: {state}, {in_flight} in flight, "
+            "{requests} requests, {failures} failures".format(**x)
+            for x in egress_pool.stats()
+        )
+    await update.message.reply_text("\n".join(output))
+
+
 @verify_admin
 async def update_database(update: Update, context: ContextTypes.DEFAULT_TYPE):
     document = update.message.reply_to_message.document
@@ -145,6 +209,7 @@ async def update_database(update: Update, context: ContextTypes.DEFAULT_TYPE):
     path = await file.download_to_drive(document.file_name)
     path.rename(DATABASE_NAME)
     init_database(context.bot_data)
+    number_index.rebuild(get_students_validity(get_session(context)))
     await update.message.reply_text("Database updated successfully...")
 
 
@@ -305,6 +370,7 @@ async def admin_help_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
         "since z minutes otherwise get results from the db)",
         "/exec command (execute a command)",
         "/get_db_len (get the number of regestred users in the bot)",
+        "/scraper_stats (current upstream concurrency window, latency and errors)",
         "/add_white_list [userid]",
         "/remove_white_list [userid]",
         "/add_admin [userid]",
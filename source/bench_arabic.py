@@ -0,0 +1,108 @@
+"""fix_arabic_encoding against the previous implementation: the repaired text must
+be the same on a regression corpus, then both are timed on the fields of real
+sized pages and on long texts
+
+usage (from the project root, like the bot itself):
+    python source/bench_arabic.py [--fields 100000]
+"""
+
+import argparse
+import random
+import time
+
+from fake_exam_server import FIRST_NAMES, LAST_NAMES, SUBJECTS, mojibake
+from helpers import ar_map, fix_arabic_encoding, is_arabic, is_ascii
+
+# texts the site sends, ascii and already repaired arabic must pass through
+CORPUS = [
+    "",
+    "None",
+    "NULL",
+    "123",
+    "Ø¨Ø±Ù…Ø¬Ø© 1",
+    "Ø±ÙŠØ§Ø¶ÙŠØ§Øª (2)",
+    "Ù\x81ÙŠØ²ÙŠØ§Ø¡ 1",
+    "Ø§Ù„Ø¹Ø±Ø¨ÙŠØ©-Ø§Ù„Ø¥Ù†Ù„ÙŠØ²ÙŠØ©",
+    "  Ù…Ø­Ù…Ø¯  ",
+    "محمد Ø§Ù„Ø£Ø­Ù…Ø¯",
+    "Ø¢Ø¡Ø¤Ø¦Ø©Ù‰ÙŽÙ€",
+    "english text, 100% ascii",
+]
+CORPUS += [key for key in ar_map]
+CORPUS += [mojibake(x) for x in FIRST_NAMES + LAST_NAMES + SUBJECTS]
+CORPUS += [
+    mojibake("{} {}".format(first, last))
+    for first in FIRST_NAMES
+    for last in LAST_NAMES
+]
+
+
+def legacy_fix_arabic_encoding(text: str) -> str:
+    # fix_arabic_encoding before it was a single translation pass
+    buffer = ""
+    fixed = ""
+    for i in range(len(text)):
+        if is_ascii(text[i]) or is_arabic(text[i]):
+            buffer = ""
+            fixed += text[i]
+            continue
+        buffer += text[i]
+        if len(buffer) == 2:
+            fixed += ar_map[buffer]
+            buffer = ""
+    return fixed
+
+
+def measure(func, texts) -> float:
+    start = time.perf_counter()
+    for text in texts:
+        func(text)
+    return time.perf_counter() - start
+
+
+def report(title: str, legacy: float, current: float):
+    print(
+        "{}: legacy {:.3f}s, current {:.3f}s ({:.1f}x)".format(
+            title, legacy, current, legacy / current
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fields", type=int, default=100000)
+    parser.add_argument("--long-text", type=int, default=50000)
+    args = parser.parse_args()
+
+    for text in CORPUS:
+        expected = legacy_fix_arabic_encoding(text)
+        assert fix_arabic_encoding(text) == expected, text
+        assert fix_arabic_encoding.__wrapped__(text) == expected, text
+
+    # a name and about eight subjects per page, the names repeat far less often
+    rng = random.Random(0)
+    fields = []
+    while len(fields) < args.fields:
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        fields.append(mojibake("{} {} {}".format(first, rng.choice(FIRST_NAMES), last)))
+        fields += [mojibake(x) for x in rng.sample(SUBJECTS, 8)]
+
+    fix_arabic_encoding.cache_clear()
+    legacy = measure(legacy_fix_arabic_encoding, fields)
+    report("page fields", legacy, measure(fix_arabic_encoding, fields))
+    report(
+        "page fields, no memo", legacy, measure(fix_arabic_encoding.__wrapped__, fields)
+    )
+
+    words = [mojibake(x) for x in FIRST_NAMES + LAST_NAMES + SUBJECTS]
+    long_text = " ".join(rng.choice(words) for _ in range(args.long_text))
+    assert fix_arabic_encoding(long_text) == legacy_fix_arabic_encoding(long_text)
+    report(
+        "{} chars text".format(len(long_text)),
+        measure(legacy_fix_arabic_encoding, [long_text]),
+        measure(fix_arabic_encoding.__wrapped__, [long_text]),
+    )
+
+
+if __name__ == "__main__":
+    main()
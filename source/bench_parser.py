@@ -0,0 +1,78 @@
+"""pages/sec of extract_data against the previous implementation, on pages of
+the fake exam server
+
+usage (from the project root, like the bot itself):
+    python source/bench_parser.py [--pages 10000]
+"""
+
+import argparse
+import time
+
+from fake_exam_server import FakeDataset
+from helpers import fix_arabic_encoding
+from html_parser import extract_data
+from lxml import etree
+from schemas import StudentCreate, SubjectMarkCreateSchema, SubjectNameCreateSchema
+from web_scrapper import WebStudentResponse
+
+
+def legacy_extract_data(student_res: WebStudentResponse) -> StudentCreate:
+    # extract_data before it parsed the bytes with a shared parser
+    parser = etree.HTMLParser(encoding="utf-8")
+    doc = etree.fromstring(student_res.html_page.decode("utf-8"), parser)
+    rows = doc.xpath("//table//tr")
+
+    student_name = fix_arabic_encoding(str(rows[0].xpath(".//td")[0].text))
+    if student_name == "None":
+        student_name = "NULL"
+
+    student_schema = StudentCreate(
+        name=student_name, university_number=student_res.student_number
+    )
+
+    if len(rows) <= 2:
+        return student_schema
+
+    for i, row in enumerate(rows[2:]):
+        columns = row.xpath(".//td")
+        subject_name = fix_arabic_encoding(str(columns[0].text).strip())
+        subject_schema = SubjectNameCreateSchema(name=subject_name)
+        amali = int(columns[1].text) if str(columns[1].text).isdigit() else 0
+        nazari = int(columns[2].text) if str(columns[2].text).isdigit() else 0
+        total = int(columns[3].text) if str(columns[3].text).isdigit() else 0
+        subject_mark_schema = SubjectMarkCreateSchema(
+            nazari=nazari, amali=amali, total=total, subject=subject_schema
+        )
+        student_schema.subjects_marks.append(subject_mark_schema)
+
+    return student_schema
+
+
+def measure(func, responses) -> float:
+    start = time.perf_counter()
+    for response in responses:
+        func(response)
+    return len(responses) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--valid-ratio", type=float, default=0.6)
+    args = parser.parse_args()
+
+    dataset = FakeDataset(args.pages, args.valid_ratio, 0)
+    responses = [
+        WebStudentResponse(x, dataset.page(x)) for x in range(1, args.pages + 1)
+    ]
+    for response in responses:
+        assert extract_data(response) == legacy_extract_data(response), response
+
+    legacy = measure(legacy_extract_data, responses)
+    current = measure(extract_data, responses)
+    print("legacy:  {:.0f} pages/s".format(legacy))
+    print("current: {:.0f} pages/s ({:.2f}x)".format(current, current / legacy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""scraper throughput benchmark against the local fake exam server
+
+usage (from the project root, like the bot itself):
+    python source/bench_scraper.py [--count 5000] [--concurrency 30] [--latency 0.2]
+    python source/bench_scraper.py --url http://127.0.0.1:8080/re.php
+"""
+
+import argparse
+import asyncio
+import time
+
+import web_scrapper
+from aiohttp import web
+from constants import HTTP_LIMIT_PER_HOST
+from fake_exam_server import Faults, FakeDataset, make_app
+from scheduler import Priority
+
+
+async def bench(args: argparse.Namespace):
+    runner = None
+    if args.url is None:
+        faults = Faults(
+            args.latency,
+            error_rate=args.error_rate,
+            drop_rate=args.drop_rate,
+            slow_body_rate=args.slow_body_rate,
+        )
+        runner = web.AppRunner(
+            make_app(FakeDataset(args.count, 0.6, 0), faults), access_log=None
+        )
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", args.port).start()
+        args.url = "http://127.0.0.1:{}/re.php".format(args.port)
+
+    web_scrapper.UNIVERSITY_URL = args.url
+    if web_scrapper.egress_pool is not None:
+        web_scrapper.egress_pool.health_check_url = args.url
+    web_scrapper.set_upstream_budget(args.concurrency)
+    await web_scrapper.init_http_session(args.concurrency, args.concurrency)
+    ok = failed = 0
+    start = time.perf_counter()
+    try:
+        async for result in web_scrapper.iter_async_request(
+            range(1, args.count + 1),
+            3,
+            Priority.BULK,
+            max_in_flight=args.concurrency,
+        ):
+            if isinstance(result, web_scrapper.FailedStudentResponse):
+                failed += 1
+            else:
+                ok += 1
+    finally:
+        await web_scrapper.close_http_session()
+        if runner is not None:
+            await runner.cleanup()
+    elapsed = time.perf_counter() - start
+
+    print("{} ok, {} failed in {:.2f}s".format(ok, failed, elapsed))
+    print("throughput: {:.1f} numbers/s".format((ok + failed) / elapsed))
+    print("controller: {}".format(web_scrapper.concurrency_controller.stats()))
+    print("hedged: {sent} sent, {won} won".format(**web_scrapper.hedge_stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="benchmark an already running server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=HTTP_LIMIT_PER_HOST)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--slow-body-rate", type=float, default=0.0)
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+
+class AIMDController:
+    """decides how many requests may hit the exam site at once, the slots
+    themselves are handed out by `scheduler.PriorityScheduler`.
+
+    the window grows by `increase` per window-worth of healthy responses and is
+    multiplied by `decrease_factor` when responses get slow or fail, like TCP's
+    congestion window. decreases are spaced by the observed latency, so a single
+    burst of failures only shrinks the window once.
+    """
+
+    def __init__(
+        self,
+        initial_window: int,
+        min_window: int,
+        max_window: int,
+        target_latency: float,
+        max_error_rate: float,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        sample_size: int = 100,
+    ):
+        self.window = float(initial_window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_ewma = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=sample_size)
+        self._latencies: Deque[float] = deque(maxlen=sample_size)
+        self._last_decrease = 0.0
+        # called when the limit grows, so the queued requests can take the slots
+        self.on_grow: Optional[Callable[[], None]] = None
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_window, int(self.window))
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    @property
+    def latency_p95(self) -> Optional[float]:
+        if len(self._latencies) < 20:
+            return None  # not enough samples to trust it yet
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    @property
+    def expected_latency(self) -> float:
+        """how long a normal answer takes, the target until the p95 is known"""
+        return self.latency_p95 or self.target_latency
+
+    def record(self, latency: float, ok: bool):
+        self.latency_ewma = (
+            latency
+            if not self.latency_ewma
+            else 0.8 * self.latency_ewma + 0.2 * latency
+        )
+        self._outcomes.append(ok)
+        if ok:
+            self._latencies.append(latency)
+        now = time.monotonic()
+        if not ok or latency > self.target_latency:
+            if now - self._last_decrease >= max(1.0, self.latency_ewma):
+                self._last_decrease = now
+                self.window = max(self.min_window, self.window * self.decrease_factor)
+        elif self.error_rate <= self.max_error_rate:
+            limit = self.limit
+            self.window = min(
+                self.max_window, self.window + self.increase / self.window
+            )
+            if self.limit > limit and self.on_grow is not None:
+                self.on_grow()
+
+    def stats(self) -> dict:
+        return {
+            "window": round(self.window, 2),
+            "latency_ewma": round(self.latency_ewma, 3),
+            "latency_p95": self.latency_p95 and round(self.latency_p95, 3),
+            "error_rate": round(self.error_rate, 3),
+        }
@@ -2,11 +2,133 @@ import json
 import os
 
 DANGER_TIME_DURATION = 60
+MAX_STUDENT_NUMBER = 100000
 DEV_ID = int(os.getenv("DEV_ID", 668270522))
 DATABASE_URL = os.getenv("DATABASE_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "marks_bot_db.sqlite3")
 DATABASE_URL = "sqlite:///{}".format(DATABASE_NAME)
 
+# can point to source/fake_exam_server.py for load testing
+UNIVERSITY_URL = os.getenv(
+    "UNIVERSITY_URL", "https://exam.homs-univ.edu.sy/exam-it/re.php"
+)
+
+# shared aiohttp connection pool used by the scraper
+HTTP_CONNECTOR_LIMIT = int(os.getenv("HTTP_CONNECTOR_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 30))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+
+# comma separated outbound routes: "direct", proxy urls or "local:<source ip>",
+# every route gets its own connection pool and concurrency budget
+EGRESS_ROUTES = [
+    x.strip() for x in os.getenv("EGRESS_ROUTES", "").split(",") if x.strip()
+]
+EGRESS_ROUTE_CONCURRENCY = int(
+    os.getenv("EGRESS_ROUTE_CONCURRENCY", HTTP_LIMIT_PER_HOST)
+)
+EGRESS_FAILURE_THRESHOLD = int(os.getenv("EGRESS_FAILURE_THRESHOLD", 5))
+EGRESS_EVICTION_TIME = float(os.getenv("EGRESS_EVICTION_TIME", 60))
+EGRESS_HEALTH_CHECK_INTERVAL = float(os.getenv("EGRESS_HEALTH_CHECK_INTERVAL", 15))
+
+# parse the pages while they're downloading, in chunks of PARSE_CHUNK_SIZE bytes,
+# bulk pages are left to the parse pool instead
+INCREMENTAL_PARSING = os.getenv("INCREMENTAL_PARSING", "1") == "1"
+PARSE_CHUNK_SIZE = int(os.getenv("PARSE_CHUNK_SIZE", 4096))
+
+# batches of at least PARSE_POOL_MIN_PAGES pages are parsed in worker processes,
+# PARSE_POOL_WORKERS=0 parses everything on the event loop
+PARSE_POOL_WORKERS = int(os.getenv("PARSE_POOL_WORKERS", os.cpu_count() or 1))
+PARSE_POOL_MIN_PAGES = int(os.getenv("PARSE_POOL_MIN_PAGES", 50))
+PARSE_POOL_BATCH_SIZE = int(os.getenv("PARSE_POOL_BATCH_SIZE", 200))
+
+# consecutive upstream failures before the scraper stops calling the exam site
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 20))
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv("BREAKER_RECOVERY_TIMEOUT", 30))
+
+# adaptive (AIMD) limit of concurrent requests to the exam site
+AIMD_INITIAL_WINDOW = int(os.getenv("AIMD_INITIAL_WINDOW", 10))
+AIMD_MIN_WINDOW = int(os.getenv("AIMD_MIN_WINDOW", 2))
+AIMD_MAX_WINDOW = int(os.getenv("AIMD_MAX_WINDOW", HTTP_LIMIT_PER_HOST))
+AIMD_TARGET_LATENCY = float(os.getenv("AIMD_TARGET_LATENCY", 3))
+AIMD_MAX_ERROR_RATE = float(os.getenv("AIMD_MAX_ERROR_RATE", 0.1))
+
+# slots of the window that bulk crawls can't take, kept free for user lookups
+SCHEDULER_BULK_RESERVE = int(os.getenv("SCHEDULER_BULK_RESERVE", 2))
+
+# seconds a single student lookup may take (queueing, retries and all), bulk
+# lookups wait for a slot as long as it takes and start counting once they get it
+REQUEST_DEADLINE_INTERACTIVE = float(os.getenv("REQUEST_DEADLINE_INTERACTIVE", 15))
+REQUEST_DEADLINE_INLINE_REFRESH = float(
+    os.getenv("REQUEST_DEADLINE_INLINE_REFRESH", 20)
+)
+REQUEST_DEADLINE_DANGER = float(os.getenv("REQUEST_DEADLINE_DANGER", 30))
+REQUEST_DEADLINE_BULK = float(os.getenv("REQUEST_DEADLINE_BULK", 300))
+# an attempt the exam site doesn't answer within this many seconds has failed
+REQUEST_ATTEMPT_TIMEOUT = float(os.getenv("REQUEST_ATTEMPT_TIMEOUT", 20))
+
+# user lookups slower than the rolling p95 latency get a duplicate request
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "1") == "1"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 0.5))
+
+# recently fetched pages are served from memory for RESPONSE_CACHE_TTL seconds
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 5000))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 30))
+
+# numbers known to be invalid aren't requested again before this many seconds
+INVALID_NUMBERS_RECHECK = float(os.getenv("INVALID_NUMBERS_RECHECK", 6 * 60 * 60))
+
+# when set, every page fetched from the website is archived in this directory
+PAGE_ARCHIVE_DIR = os.getenv("PAGE_ARCHIVE_DIR")
+PAGE_ARCHIVE_SEGMENT_SIZE = int(
+    os.getenv("PAGE_ARCHIVE_SEGMENT_SIZE", 64 * 1024 * 1024)
+)
+
+# background re-crawl of the stored students, CRAWLER_BATCH_SIZE students are
+# checked every CRAWLER_INTERVAL seconds, those updated within CRAWLER_MAX_AGE
+# minutes are considered fresh. subscribed numbers (stored or not) go first once
+# they're older than CRAWLER_SUBSCRIBED_MAX_AGE minutes
+CRAWLER_ENABLED = os.getenv("CRAWLER_ENABLED", "1") == "1"
+CRAWLER_INTERVAL = float(os.getenv("CRAWLER_INTERVAL", 60))
+CRAWLER_BATCH_SIZE = int(os.getenv("CRAWLER_BATCH_SIZE", 100))
+CRAWLER_MAX_AGE = float(os.getenv("CRAWLER_MAX_AGE", 6 * 60))
+CRAWLER_SUBSCRIBED_MAX_AGE = float(os.getenv("CRAWLER_SUBSCRIBED_MAX_AGE", 10))
+
+# danger mode polls every watched number once per DANGER_POLL_INTERVAL seconds,
+# the interval is stretched past DANGER_NUMBERS_PER_POLL watched numbers
+DANGER_POLL_INTERVAL = float(os.getenv("DANGER_POLL_INTERVAL", 10))
+DANGER_MAX_POLL_INTERVAL = float(os.getenv("DANGER_MAX_POLL_INTERVAL", 60))
+DANGER_NUMBERS_PER_POLL = int(os.getenv("DANGER_NUMBERS_PER_POLL", 200))
+
+# sentinels: a few known students per cohort of SENTINEL_COHORT_SIZE numbers are
+# probed every SENTINEL_INTERVAL seconds at bulk priority, a page with more marks
+# than the stored ones triggers a cohort sweep. off unless SENTINEL_ENABLED=1
+SENTINEL_ENABLED = os.getenv("SENTINEL_ENABLED", "0") == "1"
+SENTINEL_INTERVAL = float(os.getenv("SENTINEL_INTERVAL", 30))
+SENTINEL_COHORT_SIZE = int(os.getenv("SENTINEL_COHORT_SIZE", 1000))
+SENTINELS_PER_COHORT = int(os.getenv("SENTINELS_PER_COHORT", 3))
+
+# subscriptions notifications are sent at most NOTIFIER_RATE messages per second
+NOTIFIER_RATE = int(os.getenv("NOTIFIER_RATE", 25))
+NOTIFIER_BATCH_SIZE = int(os.getenv("NOTIFIER_BATCH_SIZE", 100))
+MAX_SUBSCRIPTIONS = int(os.getenv("MAX_SUBSCRIPTIONS", 5))
+
+# the stored students of a range report are loaded REPORT_YIELD_PER at a time
+# while the report is written
+REPORT_YIELD_PER = int(os.getenv("REPORT_YIELD_PER", 500))
+
+# shard workers with nothing to claim look for released or expired shards again
+# every SHARD_POLL_INTERVAL seconds
+SHARD_POLL_INTERVAL = float(os.getenv("SHARD_POLL_INTERVAL", 1))
+
+# lookups from different users that arrive within this window share one batch,
+# a single lookup has at most LOOKUP_MAX_IN_FLIGHT numbers requested at a time
+LOOKUP_BATCH_WINDOW = float(os.getenv("LOOKUP_BATCH_WINDOW", 0.05))
+LOOKUP_MAX_BATCH_SIZE = int(os.getenv("LOOKUP_MAX_BATCH_SIZE", 50))
+LOOKUP_MAX_IN_FLIGHT = int(os.getenv("LOOKUP_MAX_IN_FLIGHT", 100))
+
+# how many scraped students are written to the db at once during range crawls
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", 200))
+
 WARINNG_MESSAGE = """
 > **إن كل ما يصدر من بوت العلامات أو قناة بوت العلامات هو مجرد عمل طلابي وغير رسمي**،
 > **وشعبة الامتحانات غير مسؤولة عنه وقد لا تكون المعلومات صحيحة.**
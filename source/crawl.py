@@ -0,0 +1,159 @@
+"""crawl student numbers from the command line, outside the bot process
+
+usage (from the project root, like the bot itself):
+    python source/crawl.py --range 1 5000 [--concurrency 30] [--export out.jsonl]
+    python source/crawl.py --file numbers.txt [--checkpoint crawl.checkpoint]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import List, Optional, Set
+
+from constants import HTTP_LIMIT_PER_HOST, PERSIST_BATCH_SIZE
+from crawler import CrawlStats, crawl_numbers
+from helpers import init_database
+from parse_pool import parse_pool
+from scheduler import Priority
+from schemas import StudentCreate
+from web_scrapper import close_http_session, init_http_session, set_upstream_budget
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def read_numbers(args: argparse.Namespace) -> List[int]:
+    if args.range:
+        start, end = args.range
+        return list(range(start, end + 1))
+    with open(args.file, "r", encoding="utf-8") as f:
+        return [int(x) for x in f.read().split() if x.isdigit()]
+
+
+def read_checkpoint(path: Optional[str]) -> Set[int]:
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {int(x) for x in f.read().split()}
+
+
+def export_line(student: StudentCreate) -> str:
+    # the subject is excluded from the schema dump, so it's added by name
+    record = student.model_dump(exclude={"subjects_marks"})
+    record["subjects_marks"] = [
+        {"subject": x.subject.name, **x.model_dump()} for x in student.subjects_marks
+    ]
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+async def crawl(
+    numbers: List[int],
+    concurrency: int,
+    export: Optional[str] = None,
+    checkpoint: Optional[str] = None,
+    batch_size: int = PERSIST_BATCH_SIZE,
+    progress_every: float = 5,
+):
+    done = read_checkpoint(checkpoint)
+    numbers = [x for x in numbers if x not in done]
+    logger.info("%d numbers to crawl, %d already done", len(numbers), len(done))
+
+    bot_data = {}
+    if export is None:
+        init_database(bot_data)
+    export_file = open(export, "a", encoding="utf-8") if export else None
+    checkpoint_file = open(checkpoint, "a", encoding="utf-8") if checkpoint else None
+    last_report = time.time()
+
+    def on_batch(students: List[StudentCreate], stats: CrawlStats):
+        nonlocal last_report
+        if export_file:
+            for student in students:
+                export_file.write(export_line(student))
+            export_file.flush()
+        # only the saved numbers are skipped when resuming
+        if checkpoint_file:
+            checkpoint_file.write(
+                "".join("{}\n".format(x.university_number) for x in students)
+            )
+            checkpoint_file.flush()
+        if time.time() - last_report >= progress_every:
+            last_report = time.time()
+            crawled = stats.updated + stats.no_changes
+            logger.info(
+                "%d/%d done, %d failed, %.1f numbers/s",
+                crawled + stats.failed,
+                len(numbers),
+                stats.failed,
+                crawled / max(stats.elapsed, 1e-9),
+            )
+
+    set_upstream_budget(concurrency)
+    await init_http_session(limit=concurrency, limit_per_host=concurrency)
+    try:
+        stats = await crawl_numbers(
+            bot_data.get("db_session"),
+            numbers,
+            Priority.BULK,
+            batch_size=batch_size,
+            max_in_flight=concurrency,
+            on_batch=on_batch,
+        )
+    finally:
+        await close_http_session()
+        parse_pool.shutdown()
+        if export_file:
+            export_file.close()
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    crawled = stats.updated + stats.no_changes
+    logger.info(
+        "crawled %d numbers in %.1fs (%.1f numbers/s), %d updated, "
+        "%d without changes, %d failed",
+        crawled,
+        stats.elapsed,
+        crawled / max(stats.elapsed, 1e-9),
+        stats.updated,
+        stats.no_changes,
+        stats.failed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--range", type=int, nargs=2, metavar=("START", "END"))
+    source.add_argument("--file", help="a file of whitespace separated numbers")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=HTTP_LIMIT_PER_HOST,
+        help="max in flight requests",
+    )
+    parser.add_argument(
+        "--export", help="append the students to this jsonl file instead of the db"
+    )
+    parser.add_argument(
+        "--checkpoint", help="saved numbers are written here and skipped on resume"
+    )
+    parser.add_argument("--batch-size", type=int, default=PERSIST_BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(
+        crawl(
+            read_numbers(args),
+            args.concurrency,
+            args.export,
+            args.checkpoint,
+            args.batch_size,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
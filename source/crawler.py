@@ -0,0 +1,172 @@
+import logging
+import math
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from constants import (
+    CRAWLER_BATCH_SIZE,
+    CRAWLER_MAX_AGE,
+    CRAWLER_SUBSCRIBED_MAX_AGE,
+    HTTP_CONNECTOR_LIMIT,
+    PERSIST_BATCH_SIZE,
+)
+from helpers import get_session
+from number_index import number_index
+from parse_pool import parse_pool
+from queries import (
+    get_stale_students,
+    get_stale_subscribed_numbers,
+    update_or_insert_students_data,
+)
+from scheduler import Priority
+from schemas import StudentCreate
+from sqlalchemy.orm import Session, sessionmaker
+from telegram.ext import ContextTypes
+from web_scrapper import (
+    FailedStudentResponse,
+    WebStudentResponse,
+    exam_site_breaker,
+    iter_async_request,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CrawlStats:
+    # the students whose marks were added or changed, and the other crawled ones
+    updated: int = 0
+    no_changes: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+
+async def crawl_numbers(
+    Session: Optional[sessionmaker[Session]],
+    numbers: Iterable[int],
+    priority: Priority = Priority.BULK,
+    recurse_limit: int = 3,
+    batch_size: int = PERSIST_BATCH_SIZE,
+    max_in_flight: int = HTTP_CONNECTOR_LIMIT,
+    on_batch: Optional[Callable[[List[StudentCreate], CrawlStats], None]] = None,
+) -> CrawlStats:
+    """fetch the numbers from the website, parse them (in the parse pool) and save
+    them to the db in batches as they arrive, the students whose marks didn't
+    change (new invalid numbers included) are counted as `no_changes`. without a
+    `Session` nothing is saved and every student is counted as updated.
+
+    `on_batch` gets every parsed batch once it's saved, with the stats so far
+    """
+    stats = CrawlStats()
+    start = time.time()
+    pages_batch: List[WebStudentResponse] = []
+
+    async def flush():
+        if pages_batch:
+            students = []
+            for student in await parse_pool.parse(pages_batch):
+                if isinstance(student, FailedStudentResponse):
+                    stats.failed += 1
+                    continue
+                number_index.record(student)
+                students.append(student)
+            if Session is None:
+                changed = students
+            else:
+                with Session() as session:
+                    changed = update_or_insert_students_data(session, students)
+            stats.updated += len(changed)
+            stats.no_changes += len(students) - len(changed)
+            stats.elapsed = time.time() - start
+            if on_batch:
+                on_batch(students, stats)
+        pages_batch.clear()
+
+    async for result in iter_async_request(
+        numbers, recurse_limit, priority, max_in_flight
+    ):
+        if isinstance(result, FailedStudentResponse):
+            stats.failed += 1
+            continue
+        pages_batch.append(result)
+        if len(pages_batch) >= batch_size:
+            await flush()
+    await flush()
+    stats.elapsed = time.time() - start
+    return stats
+
+
+class StalenessCrawler:
+    """re-crawls the stored valid students in the background, the ones that
+    haven't been updated for the longest time and are requested the most first.
+    the subscribed numbers older than `subscribed_max_age` come before them, even
+    the ones that aren't stored yet
+    """
+
+    def __init__(self, batch_size: int, max_age: float, subscribed_max_age: float):
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.subscribed_max_age = subscribed_max_age
+        self.request_counts: Counter = Counter()
+        self.total = CrawlStats()
+        self.last_run = CrawlStats()
+        self._is_running = False
+
+    def note_request(self, numbers: Iterable[int]):
+        self.request_counts.update(int(x) for x in numbers)
+
+    def plan(self, candidates: List[Tuple[int, datetime]], now: datetime) -> List[int]:
+        def score(candidate: Tuple[int, datetime]) -> float:
+            number, last_update = candidate
+            age = (now - last_update).total_seconds()
+            return age * (1 + math.log1p(self.request_counts[number]))
+
+        ranked = sorted(candidates, key=score, reverse=True)
+        return [number for number, _ in ranked[: self.batch_size]]
+
+    async def run_once(self, Session: sessionmaker[Session]):
+        if self._is_running or exam_site_breaker.is_open:
+            return
+        self._is_running = True
+        try:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            subscribed = get_stale_subscribed_numbers(
+                Session,
+                now - timedelta(minutes=self.subscribed_max_age),
+                self.batch_size,
+            )
+            # look further than one batch, so popular students can jump the queue
+            candidates = get_stale_students(
+                Session, now - timedelta(minutes=self.max_age), self.batch_size * 5
+            )
+            numbers = list(dict.fromkeys(subscribed + self.plan(candidates, now)))
+            numbers = numbers[: self.batch_size]
+            if not numbers:
+                return
+            self.last_run = await crawl_numbers(Session, numbers)
+            for number in numbers:
+                self.request_counts.pop(number, None)
+            self.total.updated += self.last_run.updated
+            self.total.no_changes += self.last_run.no_changes
+            self.total.failed += self.last_run.failed
+            self.total.elapsed += self.last_run.elapsed
+        finally:
+            self._is_running = False
+
+    def stats(self) -> dict:
+        return {"total": asdict(self.total), "last_run": asdict(self.last_run)}
+
+
+stale_crawler = StalenessCrawler(
+    CRAWLER_BATCH_SIZE, CRAWLER_MAX_AGE, CRAWLER_SUBSCRIBED_MAX_AGE
+)
+
+
+async def crawl_stale_students(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await stale_crawler.run_once(get_session(context))
+    except Exception:
+        logger.exception("background crawl failed")
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+import aiohttp
+from constants import (
+    EGRESS_EVICTION_TIME,
+    EGRESS_FAILURE_THRESHOLD,
+    EGRESS_HEALTH_CHECK_INTERVAL,
+    EGRESS_ROUTE_CONCURRENCY,
+    EGRESS_ROUTES,
+    HTTP_KEEPALIVE_TIMEOUT,
+    UNIVERSITY_URL,
+)
+from retry_policy import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class EgressRoute:
+    """one way out to the exam site: "direct", an http proxy url or
+    "local:<ip>" to bind the connections to a local source address
+    """
+
+    def __init__(
+        self, spec: str, concurrency: int, failure_threshold: int, eviction_time: float
+    ):
+        self.spec = spec
+        self.proxy = spec if "://" in spec else None
+        self.local_address = (
+            spec[len("local:") :] if spec.startswith("local:") else None
+        )
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        # an open breaker means the route is evicted
+        self.breaker = CircuitBreaker(failure_threshold, eviction_time)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def is_available(self) -> bool:
+        return (
+            self.breaker.state == CircuitBreaker.CLOSED
+            and self.in_flight < self.concurrency
+        )
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.concurrency,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+            local_addr=(self.local_address, 0) if self.local_address else None,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def record(self, ok: bool):
+        self.requests += 1
+        if ok:
+            self.breaker.record_success()
+            return
+        self.failures += 1
+        was_open = self.breaker.is_open
+        self.breaker.record_failure()
+        if self.breaker.is_open and not was_open:
+            logger.warning("egress route %s evicted", self.spec)
+
+
+class EgressPool:
+    """spreads the upstream requests over several routes, the least loaded healthy
+    route is picked for every request. a route that keeps failing is evicted, and
+    gets back only after a health check request through it succeeds.
+    """
+
+    def __init__(
+        self,
+        specs: List[str],
+        route_concurrency: int,
+        failure_threshold: int,
+        eviction_time: float,
+        health_check_interval: float,
+    ):
+        self.routes = [
+            EgressRoute(x, route_concurrency, failure_threshold, eviction_time)
+            for x in specs
+        ]
+        self.health_check_interval = health_check_interval
+        self.health_check_url = UNIVERSITY_URL
+        self._released = asyncio.Event()
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def capacity(self) -> int:
+        return sum(x.concurrency for x in self.routes)
+
+    async def open(self):
+        for route in self.routes:
+            if route.session is None or route.session.closed:
+                await route.open()
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for route in self.routes:
+            await route.close()
+
+    def _pick(self) -> Optional[EgressRoute]:
+        available = [x for x in self.routes if x.is_available]
+        if not available:
+            return None
+        return min(available, key=lambda x: (x.in_flight / x.concurrency, x.requests))
+
+    async def acquire(self) -> EgressRoute:
+        while True:
+            route = self._pick()
+            if route is not None:
+                route.in_flight += 1
+                return route
+            self._released.clear()
+            try:
+                # evicted routes may come back without any release
+                await asyncio.wait_for(self._released.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, route: EgressRoute, ok: Optional[bool] = None):
+        """`ok` is None when the request was cancelled before it had an answer"""
+        route.in_flight -= 1
+        if ok is not None:
+            route.record(ok)
+        self._released.set()
+
+    async def check_route(self, route: EgressRoute) -> bool:
+        try:
+            async with route.session.post(
+                self.health_check_url,
+                data={"number1": 0},
+                proxy=route.proxy,
+                timeout=aiohttp.ClientTimeout(total=10),
+            ) as req:
+                await req.read()
+                return req.status == 200
+        except Exception:
+            return False
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for route in self.routes:
+                if route.breaker.state != CircuitBreaker.HALF_OPEN:
+                    continue
+                route.breaker.allow_request()
+                if await self.check_route(route):
+                    logger.info("egress route %s is back", route.spec)
+                    route.breaker.record_success()
+                    self._released.set()
+                else:
+                    route.breaker.record_failure()
+
+    def stats(self) -> List[dict]:
+        return [
+            {
+                "route": x.spec,
+                "state": x.breaker.state,
+                "in_flight": x.in_flight,
+                "requests": x.requests,
+                "failures": x.failures,
+            }
+            for x in self.routes
+        ]
+
+
+egress_pool = (
+    EgressPool(
+        EGRESS_ROUTES,
+        EGRESS_ROUTE_CONCURRENCY,
+        EGRESS_FAILURE_THRESHOLD,
+        EGRESS_EVICTION_TIME,
+        EGRESS_HEALTH_CHECK_INTERVAL,
+    )
+    if EGRESS_ROUTES
+    else None
+)
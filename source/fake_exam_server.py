@@ -0,0 +1,186 @@
+"""a local stand-in for the exam site's re.php, for load testing the scraper
+without touching the real website
+
+usage (from the project root, like the bot itself):
+    python source/fake_exam_server.py [--port 8080] [--latency 0.2] [--error-rate 0.05]
+    UNIVERSITY_URL=http://127.0.0.1:8080/re.php python source/main.py
+"""
+
+import argparse
+import asyncio
+import math
+import random
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from aiohttp import web
+from helpers import ar_map
+
+# the letters of the site's mis-encoded arabic
+MOJIBAKE = {}
+for key, letter in ar_map.items():
+    MOJIBAKE.setdefault(letter, key)
+
+FIRST_NAMES = ["محمد", "أحمد", "علي", "حسن", "سارة", "ليلى", "عمر", "خالد", "رنا"]
+FIRST_NAMES += ["زينب", "مريم", "سامر", "هبة", "نور", "ماهر", "رهام", "جود", "شهد"]
+FIRST_NAMES += ["فادي", "فاطمة", "يوسف", "فرح"]
+LAST_NAMES = ["الأحمد", "الخطيب", "الحسين", "العلي", "الشامي", "النجار", "الزين"]
+LAST_NAMES += ["الحمصي", "الدباغ", "السيد", "الجاسم", "الحلبي", "الرحمون"]
+LAST_NAMES += ["الفارس", "الصوفي"]
+SUBJECTS = ["برمجة 1", "برمجة 2", "رياضيات 1", "رياضيات 2", "شبكات حاسوبية"]
+SUBJECTS += ["قواعد معطيات", "خوارزميات", "ذكاء صنعي", "تحليل عددي", "نظم تشغيل"]
+SUBJECTS += ["لغة انكليزية", "بنى معطيات", "احتمالات", "هندسة برمجيات", "أمن شبكات"]
+SUBJECTS += ["فيزياء 1", "فيزياء 2"]
+HEADER = ["اسم المادة", "درجة العملي", "درجة النظري", "الدرجة النهائية"]
+
+
+def mojibake(text: str) -> str:
+    return "".join(MOJIBAKE.get(x, x) for x in text)
+
+
+@dataclass
+class FakeStudent:
+    name: str
+    marks: List[Tuple[str, int, int, int]]
+
+
+class FakeDataset:
+    """students generated from the number itself, so every run (and every server
+    process) with the same seed answers the same pages
+    """
+
+    def __init__(self, max_number: int, valid_ratio: float, seed: int):
+        self.max_number = max_number
+        self.valid_ratio = valid_ratio
+        self.seed = seed
+
+    def student(self, number: int) -> Optional[FakeStudent]:
+        rng = random.Random(self.seed * 1000003 + number)
+        if not 1 <= number <= self.max_number or rng.random() >= self.valid_ratio:
+            return None
+        name = "{} {}".format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        marks = []
+        for subject in rng.sample(SUBJECTS, rng.randint(0, 8)):
+            amali = rng.randint(0, 30)
+            nazari = rng.randint(0, 70)
+            marks.append((subject, amali, nazari, amali + nazari))
+        return FakeStudent(name, marks)
+
+    def page(self, number: int) -> bytes:
+        student = self.student(number)
+        rows = [
+            "<tr><td>{}</td></tr>".format(mojibake(student.name) if student else "")
+        ]
+        rows.append(
+            "<tr>{}</tr>".format(
+                "".join("<td>{}</td>".format(mojibake(x)) for x in HEADER)
+            )
+        )
+        for subject, amali, nazari, total in student.marks if student else []:
+            rows.append(
+                "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>".format(
+                    mojibake(subject), amali, nazari, total
+                )
+            )
+        return (
+            '<html dir="rtl"><head><meta charset="utf-8"></head><body>'
+            '<table border="1">{}</table></body></html>'.format("".join(rows))
+        ).encode("utf-8")
+
+
+@dataclass
+class Faults:
+    latency: float = 0.0
+    # fixed, uniform (0..2*latency) or lognormal (heavy tail around latency)
+    latency_distribution: str = "lognormal"
+    error_rate: float = 0.0
+    drop_rate: float = 0.0
+    slow_body_rate: float = 0.0
+    slow_body_delay: float = 1.0
+
+    def delay(self) -> float:
+        if self.latency <= 0:
+            return 0
+        if self.latency_distribution == "fixed":
+            return self.latency
+        if self.latency_distribution == "uniform":
+            return random.uniform(0, 2 * self.latency)
+        sigma = 0.8
+        return random.lognormvariate(math.log(self.latency) - sigma**2 / 2, sigma)
+
+
+def make_app(dataset: FakeDataset, faults: Faults) -> web.Application:
+    stats = {"requests": 0, "errors": 0, "drops": 0, "slow": 0}
+
+    async def re_php(request: web.Request) -> web.StreamResponse:
+        stats["requests"] += 1
+        form = await request.post()
+        number = form.get("number1", "")
+        await asyncio.sleep(faults.delay())
+
+        if random.random() < faults.drop_rate:
+            stats["drops"] += 1
+            request.transport.abort()
+            return web.Response()
+        if random.random() < faults.error_rate:
+            stats["errors"] += 1
+            return web.Response(status=random.choice([500, 502, 503]))
+
+        page = dataset.page(int(number)) if number.isdigit() else dataset.page(0)
+        if random.random() >= faults.slow_body_rate:
+            return web.Response(body=page, content_type="text/html", charset="utf-8")
+
+        # send the body in small pieces, over slow_body_delay seconds
+        stats["slow"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/html"})
+        response.content_length = len(page)
+        await response.prepare(request)
+        chunks = [page[i : i + 256] for i in range(0, len(page), 256)]
+        for chunk in chunks:
+            await response.write(chunk)
+            await asyncio.sleep(faults.slow_body_delay / len(chunks))
+        await response.write_eof()
+        return response
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/re.php", re_php)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-number", type=int, default=100000)
+    parser.add_argument("--valid-ratio", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean, seconds")
+    parser.add_argument(
+        "--latency-distribution",
+        choices=["fixed", "uniform", "lognormal"],
+        default="lognormal",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="5xx answers")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="closed sockets")
+    parser.add_argument("--slow-body-rate", type=float, default=0.0)
+    parser.add_argument("--slow-body-delay", type=float, default=1.0)
+    args = parser.parse_args()
+
+    dataset = FakeDataset(args.max_number, args.valid_ratio, args.seed)
+    faults = Faults(
+        args.latency,
+        args.latency_distribution,
+        args.error_rate,
+        args.drop_rate,
+        args.slow_body_rate,
+        args.slow_body_delay,
+    )
+    web.run_app(make_app(dataset, faults), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import functools
 import logging
 import random
 from io import BytesIO
@@ -278,16 +279,19 @@ def is_ascii(x: str) -> bool:
     return ord(x) < 128
 
 
+# the site sends utf-8 arabic decoded as cp1252, so every letter became a pair of
+# "Ø" or "Ù" and a second character. the second characters of the two never
+# overlap, so dropping the first ones and translating the rest repairs the whole
+# text in a single pass
+_mojibake_table = {ord(key[0]): None for key in ar_map}
+_mojibake_table.update({ord(key[1]): letter for key, letter in ar_map.items()})
+
+
+@functools.lru_cache(maxsize=8192)
 def fix_arabic_encoding(text: str) -> str:
-    buffer = ""
-    fixed = ""
-    for i in range(len(text)):
-        if is_ascii(text[i]) or is_arabic(text[i]):
-            buffer = ""
-            fixed += text[i]
-            continue
-        buffer += text[i]
-        if len(buffer) == 2:
-            fixed += ar_map[buffer]
-            buffer = ""
-    return fixed
+    """subject and student names repeat on almost every page, so the repaired
+    texts are memoized
+    """
+    if text.isascii():
+        return text
+    return text.translate(_mojibake_table)
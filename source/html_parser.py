@@ -1,15 +1,15 @@
-from typing import List
+from typing import BinaryIO, Iterable, Tuple
 
 from constants import HTML_SIGN
-from helpers import fix_arabic_encoding, is_passed
+from helpers import is_passed
 from lxml import etree
-from schemas import StudentCreate, SubjectMarkCreateSchema, SubjectNameCreateSchema
+from page_parser import parse_page
+from schemas import StudentCreate
 from web_scrapper import WebStudentResponse
 
 
-def initialize_table():
-    root = etree.Element("html", dir="rtl")
-    head = etree.SubElement(root, "head")
+def initialize_head():
+    head = etree.Element("head")
     etree.SubElement(
         head, "meta", http_equiv="Content-Type", content="text/html; charset=UTF-8"
     )
@@ -39,6 +39,10 @@ def initialize_table():
         padding: 6px;
         }
     """
+    return head
+
+
+def initialize_header_row():
     nfrowhtml = """
 <tr>
 <td style="color:#fff;background-color:#7a7a7a;font-size: 22px;">اسم المادة</td>
@@ -48,56 +52,26 @@ def initialize_table():
 <td style="color:#fff;background-color:#7a7a7a;font-size: 22px;">الدرجة النهائية</td>
 </tr>
     """
-    body = etree.SubElement(root, "body")
-    h1 = etree.SubElement(body, "h1")
-    h1.text = HTML_SIGN
-    table = etree.SubElement(body, "table")
-    nfrow = etree.fromstring(nfrowhtml)
-    table.append(nfrow)
-    return root
-
-
-def extract_data(student_res: WebStudentResponse) -> StudentCreate:
-    parser = etree.HTMLParser(encoding="utf-8")
-    doc = etree.fromstring(student_res.html_page.decode("utf-8"), parser)
-    rows = doc.xpath("//table//tr")
-
-    student_name = fix_arabic_encoding(str(rows[0].xpath(".//td")[0].text))
-    if student_name == "None":
-        student_name = "NULL"
-
-    student_schema = StudentCreate(
-        name=student_name, university_number=student_res.student_number
-    )
+    return etree.fromstring(nfrowhtml)
 
-    if len(rows) <= 2:
-        return student_schema
 
-    for i, row in enumerate(rows[2:]):
-        columns = row.xpath(".//td")
-        subject_name = fix_arabic_encoding(str(columns[0].text).strip())
-        subject_schema = SubjectNameCreateSchema(name=subject_name)
-        amali = int(columns[1].text) if str(columns[1].text).isdigit() else 0
-        nazari = int(columns[2].text) if str(columns[2].text).isdigit() else 0
-        total = int(columns[3].text) if str(columns[3].text).isdigit() else 0
-        subject_mark_schema = SubjectMarkCreateSchema(
-            nazari=nazari, amali=amali, total=total, subject=subject_schema
-        )
-        student_schema.subjects_marks.append(subject_mark_schema)
+def make_h1(text: str):
+    h1 = etree.Element("h1")
+    h1.text = text
+    return h1
 
-    return student_schema
 
-
-def get_rows_lenght(html_content: bytes) -> int:
-    parser = etree.HTMLParser(encoding="utf-8")
-    doc = etree.fromstring(html_content.decode("utf-8"), parser)
-    rows = doc.xpath("//table//tr")
-    return len(rows)
+def extract_data(student_res: WebStudentResponse) -> StudentCreate:
+    if student_res.parsed is not None:
+        # parsed while downloading, copied since the db writes mutate it
+        return student_res.parsed.model_copy(deep=True)
+    return parse_page(student_res.student_number, student_res.html_page)
 
 
-def html_maker(students: List[StudentCreate]):
-    root = initialize_table()
-    table = root.xpath("//table")[0]
+def write_students_rows(xf, students: Iterable[StudentCreate]) -> Tuple[int, int]:
+    """writes the rows of every student as soon as they're made, returns the
+    counts of the passed and the failed students
+    """
     cnt = 0
     cnt2 = 0
     passed_students, failed_students = 0, 0
@@ -155,14 +129,31 @@ def html_maker(students: List[StudentCreate]):
                 base_row.attrib["style"] = (
                     "border-bottom-style: solid;"  # add border to the last row in a student rows
                 )
-            table.append(base_row)
+            xf.write(base_row)
             base_row = etree.Element("tr")
-    body = table = root.xpath("//body")[0]
-    total_students = passed_students + failed_students
-    h1 = etree.SubElement(body, "h1")
-    h1.text = "عدد الراسبين: {} من أصل {}".format(failed_students, total_students)
-    h2 = etree.SubElement(body, "h1")
-    h2.text = "نسبة الرسوب: {}%".format(
-        round(failed_students / total_students * 100, 2)
-    )
-    return etree.tostring(root)
+    return passed_students, failed_students
+
+
+def html_maker(students: Iterable[StudentCreate], output: BinaryIO):
+    """streams the report to `output` while the students are consumed, so the
+    memory doesn't grow with the number of students
+    """
+    with etree.xmlfile(output) as xf, xf.element("html", dir="rtl"):
+        xf.write(initialize_head())
+        with xf.element("body"):
+            xf.write(make_h1(HTML_SIGN))
+            with xf.element("table"):
+                xf.write(initialize_header_row())
+                passed_students, failed_students = write_students_rows(xf, students)
+            total_students = passed_students + failed_students
+            xf.write(
+                make_h1(
+                    "عدد الراسبين: {} من أصل {}".format(failed_students, total_students)
+                )
+            )
+            failed_rate = (
+                round(failed_students / total_students * 100, 2)
+                if total_students
+                else 0
+            )
+            xf.write(make_h1("نسبة الرسوب: {}%".format(failed_rate)))
@@ -0,0 +1,156 @@
+import asyncio
+from typing import AsyncIterator, Dict, Iterable, List, Set, Union
+
+from constants import LOOKUP_BATCH_WINDOW, LOOKUP_MAX_BATCH_SIZE, LOOKUP_MAX_IN_FLIGHT
+from scheduler import Priority
+from web_scrapper import FailedStudentResponse, WebStudentResponse, iter_async_request
+
+LookupResult = Union[WebStudentResponse, FailedStudentResponse]
+
+
+class LookupCoordinator:
+    """sits in front of the scraper, so that every number is fetched once no matter
+    how many users are waiting for it, and numbers requested by different users
+    within `batch_window` seconds are fetched together in one batch.
+
+    every priority has its own queue, so a batch never runs ahead of its class. a
+    number is only shared with a lookup of the same or a more urgent priority, a
+    more urgent lookup moves it to its own queue if its batch hasn't started yet
+    or else fetches it again. the shared futures always resolve to a `LookupResult` (never an exception),
+    so a waiter that gives up doesn't affect the others.
+    """
+
+    def __init__(self, batch_window: float, max_batch_size: int, max_in_flight: int):
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.requested_numbers = 0
+        self.coalesced_numbers = 0
+        self._in_flight: Dict[int, asyncio.Future] = {}
+        self._in_flight_priority: Dict[int, Priority] = {}
+        self._queued: Dict[Priority, Dict[int, asyncio.Future]] = {}
+        self._queued_recurse_limit: Dict[Priority, int] = {}
+        self._flush_handles: Dict[Priority, asyncio.TimerHandle] = {}
+        self._batch_tasks: Set[asyncio.Task] = set()
+
+    async def iter_fetch(
+        self,
+        numbers: Iterable[int],
+        recurse_limit: int = 2,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> AsyncIterator[LookupResult]:
+        """results in completion order, at most `max_in_flight` of the numbers
+        are requested at a time
+        """
+        numbers = iter(dict.fromkeys(map(int, numbers)))
+        pending: Set[asyncio.Future] = set()
+        while True:
+            while len(pending) < self.max_in_flight:
+                number = next(numbers, None)
+                if number is None:
+                    break
+                pending.add(self._get_future(number, recurse_limit, priority))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                yield future.result()
+
+    async def fetch(
+        self,
+        numbers: Iterable[int],
+        recurse_limit: int = 2,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> List[WebStudentResponse]:
+        futures = [self._get_future(int(x), recurse_limit, priority) for x in numbers]
+        results = await asyncio.gather(*(asyncio.shield(x) for x in futures))
+        for result in results:
+            if isinstance(result, FailedStudentResponse):
+                raise result.error
+        return results
+
+    def _get_future(
+        self, number: int, recurse_limit: int, priority: Priority
+    ) -> asyncio.Future:
+        self.requested_numbers += 1
+        future = self._in_flight.get(number)
+        if future is not None:
+            current = self._in_flight_priority[number]
+            # danger polls skip the response cache, so they don't share the page
+            # of a less fresh lookup
+            if current <= priority and (
+                priority != Priority.DANGER or current == Priority.DANGER
+            ):
+                self.coalesced_numbers += 1
+                return future
+            queued = self._queued.get(current, {})
+            if current > priority and number in queued:
+                del queued[number]
+                self.coalesced_numbers += 1
+                self._enqueue(number, future, recurse_limit, priority)
+                return future
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[number] = future
+        self._enqueue(number, future, recurse_limit, priority)
+        return future
+
+    def _enqueue(
+        self,
+        number: int,
+        future: asyncio.Future,
+        recurse_limit: int,
+        priority: Priority,
+    ):
+        self._in_flight_priority[number] = priority
+        queued = self._queued.setdefault(priority, {})
+        queued[number] = future
+        self._queued_recurse_limit[priority] = max(
+            self._queued_recurse_limit.get(priority, 0), recurse_limit
+        )
+        if len(queued) >= self.max_batch_size:
+            self._flush(priority)
+        elif priority not in self._flush_handles:
+            self._flush_handles[priority] = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush, priority
+            )
+
+    def _flush(self, priority: Priority):
+        flush_handle = self._flush_handles.pop(priority, None)
+        if flush_handle is not None:
+            flush_handle.cancel()
+        batch = self._queued.pop(priority, None)
+        recurse_limit = self._queued_recurse_limit.pop(priority, 0)
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._fetch_batch(batch, recurse_limit, priority))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _fetch_batch(
+        self, batch: Dict[int, asyncio.Future], recurse_limit: int, priority: Priority
+    ):
+        try:
+            async for result in iter_async_request(
+                list(batch), recurse_limit, priority
+            ):
+                self._resolve(batch.pop(result.student_number), result)
+        except BaseException as e:
+            for number, future in batch.items():
+                self._resolve(future, FailedStudentResponse(number, e))
+            raise
+
+    def _resolve(self, future: asyncio.Future, result: LookupResult):
+        if self._in_flight.get(result.student_number) is future:
+            del self._in_flight[result.student_number]
+            del self._in_flight_priority[result.student_number]
+        if not future.done():
+            future.set_result(result)
+
+
+lookup_coordinator = LookupCoordinator(
+    LOOKUP_BATCH_WINDOW, LOOKUP_MAX_BATCH_SIZE, LOOKUP_MAX_IN_FLIGHT
+)
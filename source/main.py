@@ -7,6 +7,7 @@ import re
 import time
 import traceback
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from io import BytesIO
 from random import random
 from typing import List, Optional
@@ -29,16 +30,30 @@ from admin_commands import (
     get_total_users,
     remove_admin,
     remove_white_list,
+    scraper_stats,
     send_db_backup,
     send_db_now,
     send_message,
     unblock_user,
     update_database,
     pdf_get_from_db_by_subject,
-    pdf_get_all_subjects
+    pdf_get_all_subjects,
 )
 from concurent_update_processer import ConcurentUpdateProcessor
-from constants import DANGER_TIME_DURATION, DEV_ID, FILE_CAPTION, START_MESSAGE
+from constants import (
+    CRAWLER_ENABLED,
+    CRAWLER_INTERVAL,
+    DANGER_TIME_DURATION,
+    DEV_ID,
+    FILE_CAPTION,
+    MAX_STUDENT_NUMBER,
+    MAX_SUBSCRIPTIONS,
+    REPORT_YIELD_PER,
+    SENTINEL_ENABLED,
+    SENTINEL_INTERVAL,
+    START_MESSAGE,
+)
+from crawler import crawl_numbers, crawl_stale_students, stale_crawler
 from helpers import (
     acquire_task_or_drop,
     check_and_insert_user,
@@ -51,22 +66,34 @@ from helpers import (
 )
 from html_parser import (
     extract_data,
-    get_rows_lenght,
     html_maker,
 )
+from lookup_coordinator import lookup_coordinator
 from models import Season
+from notifier import notifier
+from number_index import number_index
+from page_archive import page_archive
+from parse_pool import parse_pool
 from queries import (
+    add_subscription,
     get_all_season,
     get_marks_by_season,
     get_season_by_id,
     get_student,
     get_students_set,
+    get_students_validity,
     get_students_within_range,
     get_user_from_db,
+    get_user_subscriptions,
+    iter_students_within_range,
+    remove_subscriptions,
     search_by_name_db,
     update_or_insert_students_data,
 )
-from schemas import StudentSchema, SubjectMarkSchema
+from retry_policy import CircuitOpenError
+from scheduler import Priority
+from schemas import StudentCreate, StudentSchema, SubjectMarkSchema
+from sentinel_detector import probe_sentinels
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -77,6 +104,7 @@ from telegram import (
 from telegram.constants import ParseMode
 from telegram.ext import (
     Application,
+    CallbackContext,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
@@ -86,7 +114,15 @@ from telegram.ext import (
     filters,
 )
 from telegram.helpers import escape_markdown
-from web_scrapper import multi_async_request
+from watch_registry import watch_registry
+from web_scrapper import (
+    FailedStudentResponse,
+    WebStudentResponse,
+    close_http_session,
+    exam_site_breaker,
+    init_http_session,
+    iter_async_request,
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -126,7 +162,7 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 def validate_input(numbers: List[str]) -> bool:
     for number in numbers:
-        if not (number.isdigit() and 1 <= int(number) <= 100000):
+        if not (number.isdigit() and 1 <= int(number) <= MAX_STUDENT_NUMBER):
             return False
     return True
 
@@ -223,7 +259,19 @@ async def responser(
             return await update.message.reply_text("أدخل أرقام صحيحة ...")
         numbers = list(map(int, numbers))
 
+    stale_crawler.note_request(numbers)
+
+    if exam_site_breaker.is_open and not (query or html_bl):
+        # the exam site is down, answer from the stored marks right away
+        return await get_stored_marks(update, context, numbers)
+
     if query or len(numbers) > 10 or html_bl:
+        if len(numbers) > 10:
+            priority = Priority.BULK
+        elif query:
+            priority = Priority.INLINE_REFRESH
+        else:
+            priority = Priority.INTERACTIVE
         task_uuid = str(uuid4())
         coro = doing_the_work(
             update,
@@ -235,6 +283,7 @@ async def responser(
             caption,
             user_msg_id=query.message.id if query else None,
             recurse_limit=recurse_limit,
+            priority=priority,
         )
         task = asyncio.Task(coro)
 
@@ -356,6 +405,7 @@ async def doing_the_work(
     caption: Optional[str] = None,
     user_msg_id: int | None = None,
     recurse_limit=2,
+    priority: Priority = Priority.INTERACTIVE,
 ):
     students_data = None
     keyboard = InlineKeyboardMarkup(
@@ -375,8 +425,40 @@ async def doing_the_work(
         reply_markup=keyboard,
     )
     try:
-        gathered_results = await multi_async_request(numbers, recurse_limit)
-        students_data = [extract_data(x) for x in gathered_results]
+        # known invalid numbers are answered without asking the website, unless
+        # the user asked for a refresh: a stored "NULL" may be published by now
+        known_invalid = set()
+        if priority != Priority.INLINE_REFRESH:
+            known_invalid = {x for x in numbers if number_index.is_known_invalid(x)}
+        fetched_students = [
+            StudentCreate(name="NULL", university_number=x) for x in known_invalid
+        ]
+        failed_results: List[FailedStudentResponse] = []
+        responses: List[WebStudentResponse] = []
+        to_fetch = [x for x in numbers if x not in known_invalid]
+        # ranges and html reports go to the scraper directly, the coordinator is
+        # for the few numbers that users are waiting on
+        if priority == Priority.BULK or html_bl:
+            results = iter_async_request(to_fetch, recurse_limit, priority)
+        else:
+            results = lookup_coordinator.iter_fetch(to_fetch, recurse_limit, priority)
+        async for result in results:
+            if isinstance(result, FailedStudentResponse):
+                failed_results.append(result)
+                continue
+            responses.append(result)
+        # big ranges are parsed in the parse pool, off the event loop
+        for student in await parse_pool.parse(responses):
+            if isinstance(student, FailedStudentResponse):
+                failed_results.append(student)
+                continue
+            number_index.record(student)
+            fetched_students.append(student)
+        if failed_results and not fetched_students:
+            raise failed_results[0].error
+        numbers_order = {number: i for i, number in enumerate(numbers)}
+        fetched_students.sort(key=lambda x: numbers_order[x.university_number])
+        students_data = fetched_students
 
         if len(numbers) <= 5 and not html_bl:
             await send_txt_results(
@@ -389,19 +471,35 @@ async def doing_the_work(
             )
         else:
             await message.edit_text("⌛️ يتم التحويل إلى ملف html ...")
-            html_filename = html_maker(students_data)
             filename = "marks_" + str(int(random() * 100000)) + ".html"
             if not caption:
                 caption = FILE_CAPTION
             caption += "\n{} \\- {}".format(numbers[0], numbers[-1])
-            await context.bot.send_document(
+            with BytesIO() as report:
+                html_maker(students_data, report)
+                report.seek(0)
+                await context.bot.send_document(
+                    user_id,
+                    report,
+                    caption=caption,
+                    filename=filename,
+                    parse_mode=ParseMode.MARKDOWN_V2,
+                )
+        if failed_results:
+            await context.bot.send_message(
                 user_id,
-                html_filename,
-                caption=caption,
-                filename=filename,
-                parse_mode=ParseMode.MARKDOWN_V2,
+                "تعذر جلب علامات الأرقام التالية, يرجى إعادة المحاولة:\n{}".format(
+                    " ".join(str(x.student_number) for x in failed_results)
+                ),
+                reply_to_message_id=user_msg_id,
             )
 
+    except CircuitOpenError:
+        await context.bot.send_message(
+            user_id,
+            "⚠️ موقع الامتحانات لا يستجيب حاليا، يرجى إعادة المحاولة لاحقا",
+            reply_to_message_id=user_msg_id,
+        )
     except Exception:
         logger.exception("Error:")
         await context.bot.send_message(
@@ -416,10 +514,42 @@ async def doing_the_work(
     except Exception:
         pass
     if students_data is not None:
-        Session = get_session(context)
-        with Session() as session:
-            update_or_insert_students_data(session, students_data)
-            # save student data
+        # every fetched page is handed to the db, the cache doesn't know whether
+        # a page has been saved, and unchanged students cost no writes anyway
+        fetched_students = [
+            x for x in students_data if x.university_number not in known_invalid
+        ]
+        if fetched_students:
+            Session = get_session(context)
+            with Session() as session:
+                update_or_insert_students_data(session, fetched_students)
+
+
+def rank_keyboard(university_number: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    "إظهار الترتيب",
+                    callback_data="{} {}".format(
+                        university_number,
+                        0,  # zero means get last season
+                    ),
+                )
+            ]
+        ]
+    )
+
+
+def render_subscription_result(student: StudentCreate) -> dict:
+    header = escape_markdown(
+        "🔔 صدرت علامات جديدة للرقم {}".format(student.university_number), version=2
+    )
+    return {
+        "text": header + "\n\n" + parse_marks_to_text_from_website(student),
+        "parse_mode": ParseMode.MARKDOWN_V2,
+        "reply_markup": rank_keyboard(student.university_number),
+    }
 
 
 async def send_txt_results(
@@ -439,7 +569,7 @@ async def send_txt_results(
             output = parse_marks_to_text_from_website(student)
         else:
             output = parse_marks_to_text_from_db(student, context, seasons[0])
-        if student.name == "NULL" and not student.subjects_marks: 
+        if student.name == "NULL" and not student.subjects_marks:
             coro = context.bot.send_message(
                 user_id,
                 f"الرقم الامتحاني {student.university_number} خاطئ",
@@ -451,18 +581,8 @@ async def send_txt_results(
                 "parse_mode": ParseMode.MARKDOWN_V2,
             }
             if is_from_website and student.subjects_marks:
-                send_msg_kwargs["reply_markup"] = InlineKeyboardMarkup(
-                    [
-                        [
-                            InlineKeyboardButton(
-                                "إظهار الترتيب",
-                                callback_data="{} {}".format(
-                                    student.university_number,
-                                    0,  # zero means get last season
-                                ),
-                            )
-                        ]
-                    ]
+                send_msg_kwargs["reply_markup"] = rank_keyboard(
+                    student.university_number
                 )
             if query:
                 coro = query.edit_message_text(**send_msg_kwargs)
@@ -486,6 +606,7 @@ async def cancel_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     except Exception:
         await query.answer("لقد تم إلغاء هذه العملية مسبقا", show_alert=True)
 
+
 # some redirecting functions
 @verify_blocked_user
 async def html_it(*args):
@@ -501,8 +622,11 @@ async def danger_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     stored_start_time: datetime | None = context.user_data.get("start_time")
-    if stored_start_time and datetime.now() - stored_start_time <= timedelta(
-        minutes=DANGER_TIME_DURATION
+    if (
+        stored_start_time
+        and watch_registry.is_watching(user_id)
+        and datetime.now() - stored_start_time
+        <= timedelta(minutes=DANGER_TIME_DURATION)
     ):
         output = "لقد قمت بتفعيل وضع الخطر بالفعل, تبقى `{}` دقيقة لانتهاء مدة التأهّب"
         output += "\nللالغاء إضغط على الأمر /cancel\\_danger"
@@ -528,10 +652,10 @@ async def danger_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     number = int(context.args[0])
 
     try:
-        gathered_results = await multi_async_request([number], 6)
-        last_lenght = get_rows_lenght(gathered_results[0].html_page)
+        gathered_results = await lookup_coordinator.fetch([number], 6, Priority.DANGER)
+        baseline = gathered_results[0].fingerprint
     except Exception:
-        last_lenght = 0
+        baseline = None
     output = (
         "سيقوم بالبوت في انتظار قدوم علامات جديدة لمدة `{}`".format(
             DANGER_TIME_DURATION
@@ -540,47 +664,116 @@ async def danger_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
         + "للإلغاء إضغط على /cancel\\_danger"
     )
     await update.message.reply_text(output, ParseMode.MARKDOWN_V2, quote=True)
-    user_id = get_user_id(update)
 
-    task = context.application.create_task(
-        new_update_checker(context, user_id, last_lenght, number)
-    )
-    context.user_data["stored_task"] = task
+    watch_registry.subscribe(number, user_id, baseline, DANGER_TIME_DURATION * 60)
+    context.user_data["start_time"] = datetime.now()
 
 
-async def new_update_checker(
-    context: ContextTypes.DEFAULT_TYPE, user_id: int, last_length: int, number: int
+async def notify_danger_watchers(
+    application: Application, response: WebStudentResponse, user_ids: List[int]
 ):
-    start_time = datetime.now()
-    context.user_data["start_time"] = start_time
-    while datetime.now() - start_time < timedelta(minutes=DANGER_TIME_DURATION):
-        await asyncio.sleep(10)
-        gathered_results = await multi_async_request([number])
-        if last_length != get_rows_lenght(gathered_results[0].html_page):
-            student = extract_data(gathered_results[0])
+    student = extract_data(response)
+    number_index.record(student)
+    Session = application.bot_data["db_session"]
+    with Session() as session:
+        # a copy, the db write mutates the students it's given
+        update_or_insert_students_data(session, [extract_data(response)])
+    for i, user_id in enumerate(user_ids):
+        context = CallbackContext(application, user_id=user_id)
+        context.user_data["start_time"] = None
+        try:
             await send_txt_results(
                 None, context, user_id, [student], is_from_website=True
             )
+        except Exception:
+            logger.exception("failed to send danger mode results to %s", user_id)
+        if i % 20 == 19:
+            await asyncio.sleep(1)
 
-            context.user_data["stored_task"] = None
-            break
-    else:
-        await context.bot.send_message(
-            user_id, "لم يتم إصدار أي علامات خلال فترة التأهب..."
-        )
+
+async def notify_danger_expired(
+    application: Application, number: int, user_ids: List[int]
+):
+    for user_id in user_ids:
+        CallbackContext(application, user_id=user_id).user_data["start_time"] = None
+        try:
+            await application.bot.send_message(
+                user_id, "لم يتم إصدار أي علامات خلال فترة التأهب..."
+            )
+        except Exception:
+            logger.exception("failed to notify %s about danger mode end", user_id)
 
 
 @verify_blocked_user
 async def cancel_danger(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    task = context.user_data.get("stored_task")
-    if isinstance(task, asyncio.Task):
-        task.cancel()
+    if watch_registry.unsubscribe(get_user_id(update)):
         context.user_data["start_time"] = None
         await update.message.reply_text("تم الإلغاء بنجاح !", quote=True)
     else:
         await update.message.reply_text("لا يوجد شيء قيد العمل حاليا...", quote=True)
 
 
+@verify_blocked_user
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = get_user_id(update)
+    check_and_insert_user(update, context)
+    if not context.args:
+        await update.message.reply_text(
+            "أدخل الرقم بعد كتابة الأمر مثال:\n /subscribe 3227", quote=True
+        )
+        return
+    elif not validate_input(context.args):
+        await update.message.reply_text("أدخل أرقام صحيحة فقط", quote=True)
+        return
+
+    Session = get_session(context)
+    numbers = list(dict.fromkeys(int(x) for x in context.args))
+    subscriptions = set(get_user_subscriptions(Session, user_id))
+    if user_id != DEV_ID and len(subscriptions.union(numbers)) > MAX_SUBSCRIPTIONS:
+        await update.message.reply_text(
+            "لا يمكنك الاشتراك بأكثر من {} أرقام".format(MAX_SUBSCRIPTIONS), quote=True
+        )
+        return
+    for number in numbers:
+        add_subscription(Session, user_id, number)
+    # the crawler checks the subscribed numbers every CRAWLER_SUBSCRIBED_MAX_AGE
+    # minutes, stored or not
+    await update.message.reply_text(
+        "سيتم إرسال العلامات الجديدة للأرقام التالية عند صدورها:\n{}\n".format(
+            "\n".join(str(x) for x in numbers)
+        )
+        + "للإلغاء استخدم الأمر /unsubscribe",
+        quote=True,
+    )
+
+
+@verify_blocked_user
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = get_user_id(update)
+    if context.args and not validate_input(context.args):
+        await update.message.reply_text("أدخل أرقام صحيحة فقط", quote=True)
+        return
+    numbers = [int(x) for x in context.args] if context.args else None
+    if remove_subscriptions(get_session(context), user_id, numbers):
+        await update.message.reply_text("تم الإلغاء بنجاح !", quote=True)
+    else:
+        await update.message.reply_text("لا يوجد اشتراكات لإلغائها", quote=True)
+
+
+@verify_blocked_user
+async def subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    numbers = get_user_subscriptions(get_session(context), get_user_id(update))
+    if not numbers:
+        await update.message.reply_text(
+            "لا يوجد لديك أي اشتراك، للاشتراك استخدم الأمر /subscribe", quote=True
+        )
+        return
+    await update.message.reply_text(
+        "الأرقام المشترك بها:\n{}".format("\n".join(str(x) for x in numbers)),
+        quote=True,
+    )
+
+
 async def in_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = get_user_id(update)
     user = get_user_from_db(get_session(context), user_id)
@@ -620,47 +813,54 @@ async def lazy_in_range_task(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
         )
     unsaved_numbers = all_numbers - {x.university_number for x in updated_students}
+    invalid_numbers = {x for x in unsaved_numbers if number_index.is_known_invalid(x)}
+    if invalid_numbers:
+        unsaved_numbers -= invalid_numbers
+        await update.message.reply_text(
+            "skipping {} numbers known to be invalid".format(len(invalid_numbers))
+        )
     if unsaved_numbers:
-        start = time.time()
-        responses = await multi_async_request(unsaved_numbers, 15)
-        all_students = [extract_data(x) for x in responses]
-        with Session() as session:
-            update_or_insert_students_data(session, all_students)  ####
+        stats = await crawl_numbers(
+            Session, sorted(unsaved_numbers), Priority.BULK, recurse_limit=15
+        )
         await update.message.reply_text(
-            "there's {} fethed from the website, time taken: {}".format(
-                len(unsaved_numbers), time.time() - start
+            "there's {} updated from the website "
+            "({} without changes, {} failed), time taken: {}".format(
+                stats.updated, stats.no_changes, stats.failed, stats.elapsed
             )
         )
 
-    after_date = datetime.now(timezone.utc) - timedelta(
-        minutes=time_offset, seconds=(time.time() - first_start) + 1
-    )
-    with Session() as session:
-        start = time.time()
-        # refetch data after updates and inserts
-        all_students = [
-            x
-            for x in get_students_within_range(
+    await update.message.reply_text("generating html file...")
+    filename = "marks_" + str(int(random() * 100000)) + ".html"
+    caption = FILE_CAPTION
+    caption += "\n{} \\- {}".format(start_number, end_number)
+    with BytesIO() as report:
+        with Session() as session:
+            start = time.time()
+            # refetch data after updates and inserts, every saved student was
+            # touched so the date filter would only drop the numbers that failed
+            # to be fetched again, their stored marks are still worth reporting.
+            # the students are streamed into the report as they're loaded
+            all_students = iter_students_within_range(
                 session,
                 start_number,
                 end_number,
-                after_date,
+                datetime.min,
                 season,
+                REPORT_YIELD_PER,
             )
-        ]
-    await update.message.reply_text("generating html file...")
-    html_filename = html_maker(all_students)
-    await update.message.reply_text("done, time taken: {}".format(time.time() - start))
-    filename = "marks_" + str(int(random() * 100000)) + ".html"
-    caption = FILE_CAPTION
-    caption += "\n{} \\- {}".format(start_number, end_number)
-    await context.bot.send_document(
-        user_id,
-        html_filename,
-        caption=caption,
-        filename=filename,
-        parse_mode=ParseMode.MARKDOWN_V2,
-    )
+            html_maker(all_students, report)
+        await update.message.reply_text(
+            "done, time taken: {}".format(time.time() - start)
+        )
+        report.seek(0)
+        await context.bot.send_document(
+            user_id,
+            report,
+            caption=caption,
+            filename=filename,
+            parse_mode=ParseMode.MARKDOWN_V2,
+        )
 
 
 @verify_blocked_user
@@ -699,12 +899,34 @@ def init_config_file():
         )
 
 
+async def on_startup(application: Application) -> None:
+    await init_http_session()
+    number_index.rebuild(get_students_validity(application.bot_data["db_session"]))
+    watch_registry.on_change = partial(notify_danger_watchers, application)
+    watch_registry.on_expire = partial(notify_danger_expired, application)
+    notifier.start(
+        application.bot,
+        application.bot_data["db_session"],
+        render_subscription_result,
+    )
+
+
+async def on_shutdown(application: Application) -> None:
+    await notifier.stop()
+    parse_pool.shutdown()
+    await close_http_session()
+    if page_archive is not None:
+        page_archive.close()
+
+
 def main() -> None:
     token = get_token()
     application = (
         Application.builder()
         .token(token)
         .concurrent_updates(ConcurentUpdateProcessor(256, max_updates_per_user=5))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
         .build()
     )
     conv_handler = ConversationHandler(
@@ -727,10 +949,14 @@ def main() -> None:
             CommandHandler("send_db_backup", send_db_now),
             CommandHandler("danger", danger_mode),
             CommandHandler("cancel_danger", cancel_danger),
+            CommandHandler("subscribe", subscribe),
+            CommandHandler("unsubscribe", unsubscribe),
+            CommandHandler("subscriptions", subscriptions),
             CommandHandler("in_range", in_range),
             CommandHandler("lazy_in_range", lazy_in_range),
             CommandHandler("exec", exec_command),
             CommandHandler("get_db_len", get_total_users),
+            CommandHandler("scraper_stats", scraper_stats),
             CommandHandler("update_database", update_database),
             CommandHandler("add_white_list", add_to_white_list),
             CommandHandler("remove_white_list", remove_white_list),
@@ -764,6 +990,18 @@ def main() -> None:
         timedelta(hours=6),
         timedelta(seconds=20),
     )
+    if CRAWLER_ENABLED:
+        application.job_queue.run_repeating(
+            crawl_stale_students,
+            timedelta(seconds=CRAWLER_INTERVAL),
+            timedelta(minutes=1),
+        )
+    if SENTINEL_ENABLED:
+        application.job_queue.run_repeating(
+            probe_sentinels,
+            timedelta(seconds=SENTINEL_INTERVAL),
+            timedelta(minutes=1),
+        )
     application.run_polling()
 
 
@@ -0,0 +1,66 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from models import Student
+from schemas import StudentCreate, SubjectMarkCreateSchema
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StudentChange:
+    student: StudentCreate
+    is_new: bool = False
+    # marks of subjects the student didn't have before
+    inserted: List[SubjectMarkCreateSchema] = field(default_factory=list)
+    # marks whose values differ from the stored ones
+    updated: List[SubjectMarkCreateSchema] = field(default_factory=list)
+
+    @property
+    def marks_changed(self) -> bool:
+        return bool(self.inserted or self.updated)
+
+
+def diff_student(stored: Optional[Student], fresh: StudentCreate) -> StudentChange:
+    """compares a scraped student with the stored one, subjects are matched by name"""
+    if stored is None:
+        return StudentChange(fresh, is_new=True, inserted=list(fresh.subjects_marks))
+
+    stored_marks = {x.subject.name: x for x in stored.subjects_marks}
+    change = StudentChange(fresh)
+    for mark in fresh.subjects_marks:
+        old = stored_marks.get(mark.subject.name)
+        if old is None:
+            change.inserted.append(mark)
+        elif (old.nazari, old.amali, old.total) != (
+            mark.nazari,
+            mark.amali,
+            mark.total,
+        ):
+            change.updated.append(mark)
+    return change
+
+
+Listener = Callable[[List[StudentChange]], None]
+_listeners: List[Listener] = []
+
+
+def subscribe(listener: Listener):
+    _listeners.append(listener)
+
+
+def unsubscribe(listener: Listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def publish(changes: List[StudentChange]):
+    """called after the changes are committed, with the students whose marks changed"""
+    if not changes:
+        return
+    for listener in _listeners:
+        try:
+            listener(changes)
+        except Exception:
+            logger.exception("marks change listener failed")
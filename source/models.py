@@ -7,6 +7,7 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     String,
+    UniqueConstraint,
     func,
 )
 from sqlalchemy.orm import (
@@ -103,3 +104,33 @@ class Season(Base):
     season_title: Mapped[str] = mapped_column(String(length=255), nullable=True)
     from_date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
     to_date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class Subscription(Base):
+    __tablename__ = "subscriptions"
+    __table_args__ = (UniqueConstraint("telegram_id", "university_number"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    telegram_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    university_number: Mapped[int] = mapped_column(index=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=False), default=func.now()
+    )
+
+
+class CrawlShard(Base):
+    __tablename__ = "crawl_shards"
+    __table_args__ = (UniqueConstraint("start_number", "end_number"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    start_number: Mapped[int] = mapped_column(nullable=False)
+    end_number: Mapped[int] = mapped_column(nullable=False)
+    # pending, leased, done or failed (some numbers failed every attempt)
+    status: Mapped[str] = mapped_column(
+        String(length=15), default="pending", index=True
+    )
+    worker: Mapped[Optional[str]] = mapped_column(String(length=255), nullable=True)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=False), nullable=True
+    )
+    attempts: Mapped[int] = mapped_column(default=0)
+    fetched: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[int] = mapped_column(default=0)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from typing import Callable, List, Optional, Tuple
+
+import marks_diff
+from constants import NOTIFIER_BATCH_SIZE, NOTIFIER_RATE
+from marks_diff import StudentChange
+from queries import get_subscribers, remove_subscriptions
+from schemas import StudentCreate
+from sqlalchemy.orm import Session, sessionmaker
+from telegram import Bot
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+Render = Callable[[StudentCreate], dict]
+
+
+class Notifier:
+    """sends the changed marks to the users subscribed to them.
+
+    it listens to the committed marks changes, the changed students are queued and
+    handled in batches, one db query finds the subscribers of the whole batch,
+    every student is rendered once and the messages are sent `rate` per second to
+    stay under telegram flood limits.
+    """
+
+    def __init__(self, rate: int, batch_size: int):
+        self.rate = rate
+        self.batch_size = batch_size
+        self.sent = 0
+        self.failed = 0
+        self._queue: asyncio.Queue[StudentCreate] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+        self._Session: Optional[sessionmaker[Session]] = None
+        self._render: Optional[Render] = None
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self, bot: Bot, Session: sessionmaker[Session], render: Render):
+        self._bot = bot
+        self._Session = Session
+        self._render = render
+        self._task = asyncio.create_task(self._run())
+        marks_diff.subscribe(self.on_changes)
+
+    async def stop(self):
+        marks_diff.unsubscribe(self.on_changes)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def on_changes(self, changes: List[StudentChange]):
+        if self._task is None:
+            return
+        for change in changes:
+            self._queue.put_nowait(change.student)
+
+    async def _run(self):
+        while True:
+            batch = {}
+            student = await self._queue.get()
+            batch[student.university_number] = student
+            while len(batch) < self.batch_size and not self._queue.empty():
+                student = self._queue.get_nowait()
+                batch[student.university_number] = student
+            try:
+                await self._notify(batch)
+            except Exception:
+                logger.exception("failed to notify the subscribers")
+
+    async def _notify(self, batch: dict):
+        subscribers = get_subscribers(self._Session, batch.keys())
+        messages: List[Tuple[int, dict]] = []
+        for number, telegram_ids in subscribers.items():
+            kwargs = self._render(batch[number])
+            messages.extend((telegram_id, kwargs) for telegram_id in telegram_ids)
+
+        for i in range(0, len(messages), self.rate):
+            start = time.monotonic()
+            await asyncio.gather(
+                *(
+                    self._send(chat_id, kwargs)
+                    for chat_id, kwargs in messages[i : i + self.rate]
+                )
+            )
+            await asyncio.sleep(max(0, 1 - (time.monotonic() - start)))
+
+    async def _send(self, chat_id: int, kwargs: dict):
+        for _ in range(3):
+            try:
+                await self._bot.send_message(chat_id, **kwargs)
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Forbidden:
+                # the user blocked the bot
+                remove_subscriptions(self._Session, chat_id)
+                break
+            except TelegramError:
+                logger.exception("failed to send a notification to %s", chat_id)
+                break
+        self.failed += 1
+
+
+notifier = Notifier(NOTIFIER_RATE, NOTIFIER_BATCH_SIZE)
@@ -0,0 +1,92 @@
+import time
+from typing import Iterable, Iterator, Tuple
+
+from constants import INVALID_NUMBERS_RECHECK, MAX_STUDENT_NUMBER
+from schemas import StudentCreate
+
+VALID = "valid"
+INVALID = "invalid"
+UNKNOWN = "unknown"
+
+
+class NumberIndex:
+    """two bitmaps over the student numbers space (~12KB each for 100000 numbers)
+    telling which numbers are known to be valid and which are known to be invalid.
+
+    the invalid bitmap is dropped every `recheck_interval` seconds, so numbers that
+    weren't published yet get checked against the website again.
+    """
+
+    def __init__(self, size: int, recheck_interval: float):
+        self.size = size
+        self.recheck_interval = recheck_interval
+        self._valid = bytearray(size // 8 + 1)
+        self._invalid = bytearray(size // 8 + 1)
+        self._invalid_since = time.monotonic()
+
+    def _expire_invalid(self):
+        if time.monotonic() - self._invalid_since > self.recheck_interval:
+            self._invalid = bytearray(len(self._invalid))
+            self._invalid_since = time.monotonic()
+
+    @staticmethod
+    def _get(bitmap: bytearray, number: int) -> bool:
+        return bool(bitmap[number >> 3] & (1 << (number & 7)))
+
+    @staticmethod
+    def _set(bitmap: bytearray, number: int, value: bool):
+        if value:
+            bitmap[number >> 3] |= 1 << (number & 7)
+        else:
+            bitmap[number >> 3] &= ~(1 << (number & 7))
+
+    def state(self, number: int) -> str:
+        if not 0 <= number <= self.size:
+            return UNKNOWN
+        if self._get(self._valid, number):
+            return VALID
+        self._expire_invalid()
+        if self._get(self._invalid, number):
+            return INVALID
+        return UNKNOWN
+
+    def is_known_invalid(self, number: int) -> bool:
+        return self.state(number) == INVALID
+
+    def mark(self, number: int, is_valid: bool):
+        if not 0 <= number <= self.size:
+            return
+        self._set(self._valid, number, is_valid)
+        self._set(self._invalid, number, not is_valid)
+
+    def record(self, student: StudentCreate):
+        self.mark(
+            student.university_number,
+            student.name != "NULL" or bool(student.subjects_marks),
+        )
+
+    def iter_valid(self, start: int = 0, end: int = None) -> Iterator[int]:
+        end = self.size if end is None else min(end, self.size)
+        for number in range(max(start, 0), end + 1):
+            if self._get(self._valid, number):
+                yield number
+
+    def rebuild(self, rows: Iterable[Tuple[int, bool]]):
+        self._valid = bytearray(len(self._valid))
+        self._invalid = bytearray(len(self._invalid))
+        self._invalid_since = time.monotonic()
+        for number, is_valid in rows:
+            self.mark(number, is_valid)
+
+    def counts(self) -> dict:
+        self._expire_invalid()
+        valid = sum(bin(x).count("1") for x in self._valid)
+        invalid = sum(bin(x).count("1") for x in self._invalid)
+        return {
+            VALID: valid,
+            INVALID: invalid,
+            UNKNOWN: self.size - valid - invalid,
+        }
+
+
+number_index = NumberIndex(MAX_STUDENT_NUMBER, INVALID_NUMBERS_RECHECK)
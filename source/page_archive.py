@@ -0,0 +1,106 @@
+import gzip
+import logging
+import os
+import re
+import struct
+import time
+import zlib
+from typing import Iterator, Optional, Tuple
+
+from constants import PAGE_ARCHIVE_DIR, PAGE_ARCHIVE_SEGMENT_SIZE
+
+logger = logging.getLogger(__name__)
+
+# student number, fetch timestamp, page length
+RECORD_HEADER = struct.Struct(">IdI")
+SEGMENT_PATTERN = re.compile(r"^segment-(\d{6})\.gz$")
+
+
+class PageArchive:
+    """append-only archive of the raw pages fetched from the website.
+
+    records are written to gzip compressed segment files, a new segment is started
+    every `segment_size` (uncompressed) bytes and on every restart, old segments
+    are never touched again. segments are created exclusively, so processes
+    sharing the directory never write to the same one.
+    """
+
+    def __init__(self, directory: str, segment_size: int, flush_every: int = 100):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.flush_every = flush_every
+        os.makedirs(directory, exist_ok=True)
+        self._segment_index = max(
+            (
+                int(m.group(1))
+                for m in map(SEGMENT_PATTERN.match, os.listdir(directory))
+                if m
+            ),
+            default=0,
+        )
+        self._file: Optional[gzip.GzipFile] = None
+        self._written = 0
+        self._unflushed = 0
+
+    def _open_next_segment(self):
+        self.close()
+        # other processes (the bot, crawl.py) may archive to the same directory,
+        # a segment is only ever written by the process that created it
+        while self._file is None:
+            self._segment_index += 1
+            path = os.path.join(
+                self.directory, "segment-{:06d}.gz".format(self._segment_index)
+            )
+            try:
+                self._file = gzip.open(path, "xb")
+            except FileExistsError:
+                continue
+        self._written = 0
+
+    def append(self, number: int, page: bytes, fetched_at: Optional[float] = None):
+        if self._file is None or self._written >= self.segment_size:
+            self._open_next_segment()
+        header = RECORD_HEADER.pack(number, fetched_at or time.time(), len(page))
+        self._file.write(header + page)
+        self._written += len(header) + len(page)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            # a sync flush makes everything written so far readable after a crash
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+            self._unflushed = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._unflushed = 0
+
+
+def iter_archive(directory: str) -> Iterator[Tuple[int, float, bytes]]:
+    """yields (student number, fetch timestamp, page) in the order they've been
+    archived, a segment cut by a crash is read up to its last complete record
+    """
+    segments = sorted(
+        name for name in os.listdir(directory) if SEGMENT_PATTERN.match(name)
+    )
+    for name in segments:
+        with gzip.open(os.path.join(directory, name), "rb") as f:
+            try:
+                while True:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    number, fetched_at, length = RECORD_HEADER.unpack(header)
+                    page = f.read(length)
+                    if len(page) < length:
+                        break
+                    yield number, fetched_at, page
+            except (EOFError, zlib.error):
+                logger.warning("segment %s is truncated, skipping its tail", name)
+
+
+page_archive = (
+    PageArchive(PAGE_ARCHIVE_DIR, PAGE_ARCHIVE_SEGMENT_SIZE)
+    if PAGE_ARCHIVE_DIR
+    else None
+)
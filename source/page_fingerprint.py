@@ -0,0 +1,33 @@
+import hashlib
+import re
+from dataclasses import dataclass
+
+_row_pattern = re.compile(rb"<tr[\s>]", re.IGNORECASE)
+# the text between the tags, the cells content once the whitespace is removed
+_text_pattern = re.compile(rb">([^<]+)")
+
+
+@dataclass(frozen=True)
+class PageFingerprint:
+    rows: int
+    digest: str
+
+
+def _tables(page: bytes) -> bytes:
+    start = page.find(b"<table")
+    if start < 0:
+        return page
+    return page[start : page.rfind(b"</table")]
+
+
+def page_fingerprint(page: bytes) -> PageFingerprint:
+    """the rows count and a hash of the marks tables text, read from the raw
+    bytes without building a tree. the whitespace, the markup and anything
+    outside the tables don't change it, a corrected mark does.
+    """
+    tables = _tables(page)
+    content = b"|".join(_text_pattern.findall(tables.translate(None, b" \t\r\n")))
+    return PageFingerprint(
+        rows=len(_row_pattern.findall(tables)),
+        digest=hashlib.blake2b(content, digest_size=16).hexdigest(),
+    )
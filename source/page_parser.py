@@ -0,0 +1,98 @@
+from typing import List, Optional
+
+from helpers import fix_arabic_encoding
+from lxml import etree
+from schemas import StudentCreate, SubjectMarkCreateSchema, SubjectNameCreateSchema
+
+# one parser and compiled expressions for every page, the loop is single threaded
+# and every worker process gets its own copies
+_html_parser = etree.HTMLParser(encoding="utf-8")
+_rows_xpath = etree.XPath("//table//tr")
+_cells_xpath = etree.XPath(".//td")
+
+
+def parse_name(column) -> str:
+    student_name = fix_arabic_encoding(str(column.text))
+    if student_name == "None":
+        student_name = "NULL"
+    return student_name
+
+
+def _to_int(text: Optional[str]) -> int:
+    return int(text) if text is not None and text.isdigit() else 0
+
+
+def parse_mark_row(columns: List) -> SubjectMarkCreateSchema:
+    # the values are already typed, so the models are built without validation
+    return SubjectMarkCreateSchema.model_construct(
+        nazari=_to_int(columns[2].text),
+        amali=_to_int(columns[1].text),
+        total=_to_int(columns[3].text),
+        subject=SubjectNameCreateSchema.model_construct(
+            name=fix_arabic_encoding(str(columns[0].text).strip())
+        ),
+    )
+
+
+def parse_rows(page: bytes) -> List:
+    """the rows of the page tables, parsed from the raw bytes"""
+    return _rows_xpath(etree.fromstring(page, _html_parser))
+
+
+def parse_page(number: int, page: bytes) -> StudentCreate:
+    """the first row holds the name and the second one is the marks table header"""
+    rows = parse_rows(page)
+    return StudentCreate.model_construct(
+        name=parse_name(_cells_xpath(rows[0])[0]),
+        university_number=number,
+        subjects_marks=[parse_mark_row(_cells_xpath(row)) for row in rows[2:]],
+    )
+
+
+class IncrementalPageParser:
+    """parses the marks table while the page is still being downloaded, every
+    row is handled as soon as its closing tag arrives.
+
+    the rows are read like `parse_page` does, a page may have marks before the
+    student's name is published so an empty name cell doesn't end the parsing.
+    any parsing error leaves `close()` returning None, and the caller parses the
+    whole page as usual.
+    """
+
+    def __init__(self, number: int):
+        self.student = StudentCreate.model_construct(
+            name="NULL", university_number=number, subjects_marks=[]
+        )
+        self.failed = False
+        self._rows = 0
+        self._parser = etree.HTMLPullParser(events=("end",), tag="tr", encoding="utf-8")
+
+    def feed(self, chunk: bytes):
+        if self.failed:
+            return
+        try:
+            self._parser.feed(chunk)
+            self._read_rows()
+        except Exception:
+            self.failed = True
+
+    def _read_rows(self):
+        for _, row in self._parser.read_events():
+            columns = _cells_xpath(row)
+            if self._rows == 0:
+                self.student.name = parse_name(columns[0])
+            elif self._rows >= 2:
+                self.student.subjects_marks.append(parse_mark_row(columns))
+            self._rows += 1
+            row.clear()
+
+    def close(self) -> Optional[StudentCreate]:
+        if not self.failed:
+            try:
+                self._parser.close()
+                self._read_rows()
+            except Exception:
+                self.failed = True
+        if self.failed or self._rows == 0:
+            return None
+        return self.student
@@ -0,0 +1,126 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple, Union
+
+from constants import PARSE_POOL_BATCH_SIZE, PARSE_POOL_MIN_PAGES, PARSE_POOL_WORKERS
+from html_parser import extract_data
+from page_parser import parse_page
+from schemas import StudentCreate, SubjectMarkCreateSchema, SubjectNameCreateSchema
+from web_scrapper import FailedStudentResponse, WebStudentResponse
+
+# (name, ((subject, amali, nazari, total), ...)), cheaper to pickle than the models
+CompactStudent = Tuple[str, Tuple[Tuple[str, int, int, int], ...]]
+
+
+def parse_batch(pages: List[Tuple[int, bytes]]) -> List[Optional[CompactStudent]]:
+    """runs in the worker processes, a page that can't be parsed gives None and
+    is parsed again inline, where its error is kept
+    """
+    compact = []
+    for number, page in pages:
+        try:
+            student = parse_page(number, page)
+        except Exception:
+            compact.append(None)
+            continue
+        compact.append(
+            (
+                student.name,
+                tuple(
+                    (x.subject.name, x.amali, x.nazari, x.total)
+                    for x in student.subjects_marks
+                ),
+            )
+        )
+    return compact
+
+
+def from_compact(number: int, compact: CompactStudent) -> StudentCreate:
+    name, marks = compact
+    return StudentCreate.model_construct(
+        name=name,
+        university_number=number,
+        subjects_marks=[
+            SubjectMarkCreateSchema.model_construct(
+                nazari=nazari,
+                amali=amali,
+                total=total,
+                subject=SubjectNameCreateSchema.model_construct(name=subject),
+            )
+            for subject, amali, nazari, total in marks
+        ],
+    )
+
+
+def _extract_or_fail(
+    response: WebStudentResponse,
+) -> Union[StudentCreate, FailedStudentResponse]:
+    # a maintenance page or an empty body fails its number, not the batch
+    try:
+        return extract_data(response)
+    except Exception as e:
+        return FailedStudentResponse(response.student_number, e)
+
+
+class ParsePool:
+    """parses big batches of pages in worker processes so the event loop keeps
+    answering the other users, small batches are parsed inline since sending the
+    pages to another process costs more than parsing them. a page that can't be
+    parsed is returned as a `FailedStudentResponse`
+    """
+
+    def __init__(self, max_workers: int, min_pages: int, batch_size: int):
+        self.max_workers = max_workers
+        self.min_pages = min_pages
+        self.batch_size = batch_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # forking the bot process with its running threads isn't safe
+            self._executor = ProcessPoolExecutor(
+                self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def parse(
+        self, responses: List[WebStudentResponse]
+    ) -> List[Union[StudentCreate, FailedStudentResponse]]:
+        pending = [i for i, x in enumerate(responses) if x.parsed is None]
+        if self.max_workers <= 0 or len(pending) < self.min_pages:
+            return [_extract_or_fail(x) for x in responses]
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        batches = [
+            pending[i : i + self.batch_size]
+            for i in range(0, len(pending), self.batch_size)
+        ]
+        students: List[Union[StudentCreate, FailedStudentResponse, None]] = [
+            None
+        ] * len(responses)
+
+        async def parse_in_worker(batch: List[int]):
+            pages = [
+                (responses[i].student_number, responses[i].html_page) for i in batch
+            ]
+            compacts = await loop.run_in_executor(executor, parse_batch, pages)
+            # every batch is converted as soon as it's back, to not stall the loop
+            for i, compact in zip(batch, compacts):
+                if compact is not None:
+                    students[i] = from_compact(responses[i].student_number, compact)
+
+        await asyncio.gather(*(parse_in_worker(x) for x in batches))
+        for i, response in enumerate(responses):
+            if students[i] is None:
+                students[i] = _extract_or_fail(response)
+        return students
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+parse_pool = ParsePool(PARSE_POOL_WORKERS, PARSE_POOL_MIN_PAGES, PARSE_POOL_BATCH_SIZE)
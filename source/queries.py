@@ -1,7 +1,18 @@
-from datetime import datetime
-from typing import Iterable, List, Optional
-
-from models import BotUser, Season, Student, SubjectMark, SubjectName, session_wrapper
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from marks_diff import diff_student
+from marks_diff import publish as publish_changes
+from models import (
+    BotUser,
+    CrawlShard,
+    Season,
+    Student,
+    SubjectMark,
+    SubjectName,
+    Subscription,
+    session_wrapper,
+)
 from schemas import (
     StudentCreate,
     SubjectMarkSchema,
@@ -9,7 +20,8 @@ from schemas import (
     SubjectNameSchema,
 )
 from sqlalchemy import delete as sql_delete
-from sqlalchemy import func, insert, select
+from sqlalchemy import Select, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, selectinload
 
 
@@ -129,11 +141,10 @@ def get_student(session: Session, university_id: int) -> Optional[Student]:
     return session.scalars(stmt).first()
 
 
-@session_wrapper
-def get_students_within_range(
-    session: Session, start: int, end: int, after_date: datetime, season: Season
-) -> List[Student]:
-    stmt = (
+def _students_within_range_stmt(
+    start: int, end: int, after_date: datetime, season: Season
+) -> Select[Tuple[Student]]:
+    return (
         select(
             Student,
         )
@@ -151,9 +162,90 @@ def get_students_within_range(
         )
         .order_by(Student.university_number)
     )
+
+
+@session_wrapper
+def get_students_within_range(
+    session: Session, start: int, end: int, after_date: datetime, season: Season
+) -> List[Student]:
+    stmt = _students_within_range_stmt(start, end, after_date, season)
     return session.scalars(stmt).all()
 
 
+def iter_students_within_range(
+    session: Session,
+    start: int,
+    end: int,
+    after_date: datetime,
+    season: Season,
+    yield_per: int,
+) -> Iterator[Student]:
+    """like get_students_within_range but loads `yield_per` students (and their
+    marks) at a time, the session has to stay open while it's consumed
+    """
+    stmt = _students_within_range_stmt(start, end, after_date, season)
+    yield from session.scalars(stmt.execution_options(yield_per=yield_per))
+
+
+def _is_valid_student():
+    # the same rule as `NumberIndex.record`, a page may have marks before the
+    # student's name is published
+    return or_(Student.name != "NULL", Student.subjects_marks.any())
+
+
+@session_wrapper
+def get_students_validity(session: Session) -> List[Tuple[int, bool]]:
+    """(university number, is valid) of every stored student, invalid numbers
+    are stored with "NULL" as a name and no marks
+    """
+    stmt = select(Student.university_number, _is_valid_student())
+    return [tuple(row) for row in session.execute(stmt).all()]
+
+
+@session_wrapper
+def get_stale_students(
+    session: Session, older_than: datetime, limit: int
+) -> List[Tuple[int, datetime]]:
+    """(university number, last update) of the valid students that haven't been
+    updated since `older_than`, the stalest first
+    """
+    stmt = (
+        select(Student.university_number, Student.last_update)
+        .where(_is_valid_student())
+        .where(Student.last_update < older_than)
+        .order_by(Student.last_update)
+        .limit(limit)
+    )
+    return [tuple(row) for row in session.execute(stmt).all()]
+
+
+@session_wrapper
+def get_marks_counts(
+    session: Session, students_numbers: Iterable[int]
+) -> Dict[int, int]:
+    """university number -> stored marks count, the students that aren't stored
+    are missing
+    """
+    stmt = (
+        select(Student.university_number, func.count(SubjectMark.subject_id))
+        .outerjoin(Student.subjects_marks)
+        .where(Student.university_number.in_(students_numbers))
+        .group_by(Student.university_number)
+    )
+    return dict(session.execute(stmt).all())
+
+
+@session_wrapper
+def touch_students(session: Session, students_numbers: Iterable[int]):
+    """mark students as up to date without rewriting them"""
+    stmt = (
+        update(Student)
+        .where(Student.university_number.in_(students_numbers))
+        .values(last_update=func.now())
+    )
+    session.execute(stmt)
+
+
 @session_wrapper
 def get_students_set(session: Session, students_numbers: Iterable[int], season: Season):
     stmt = (
@@ -253,6 +345,9 @@ def get_all_subjects(session: Session) -> List[SubjectName]:
 def update_or_insert_students_data(session: Session, students: List[StudentCreate]):
     """
     insert/update student data, include new subjects, marks, students
+
+    returns the numbers of the students whose marks were added or changed, their
+    changes are published to the `marks_diff` listeners
     """
     subjects = {}
     # check if there's a new subjects and create them
@@ -286,57 +381,283 @@ def update_or_insert_students_data(session: Session, students: List[StudentCreat
 
     existing_students = session.scalars(students_stmt).all()
 
-    existing_set = {x.university_number for x in existing_students}
+    stored = {x.university_number: x for x in existing_students}
+    changes = [diff_student(stored.get(x.university_number), x) for x in students]
 
     new_students = [
         Student(
-            **student.model_dump(include=["university_number", "name"]),
+            **change.student.model_dump(include=["university_number", "name"]),
             subjects_marks=[
                 SubjectMark(
                     **sub_mark.model_dump(),
                 )
-                for sub_mark in student.subjects_marks
+                for sub_mark in change.student.subjects_marks
             ],
         )
-        for student in students
-        if student.university_number not in existing_set
+        for change in changes
+        if change.is_new
     ]
-
     session.add_all(new_students)
 
-    session.commit()
-    hashed_students = {x.university_number: x for x in students}
-
-    for student in existing_students:
-        student.last_update = func.now()
-        marks = {
-            subject_mark.subject.name: subject_mark
-            for subject_mark in hashed_students[
-                student.university_number
-            ].subjects_marks
-        }
-        for subject_mark in student.subjects_marks:
-            mark = marks.get(subject_mark.subject.name)
-            if mark:
-                subject_mark.nazari = mark.nazari
-                subject_mark.amali = mark.amali
-                subject_mark.total = mark.total
-                subject_mark.last_update = func.now()
-                del marks[subject_mark.subject.name]
-
+    # a number saved before its student was published is stored with "NULL"
+    for change in changes:
+        student = stored.get(change.student.university_number)
+        if student is not None and change.student.name not in ("NULL", student.name):
+            student.name = change.student.name
+
+    # only the marks that really changed are written, so the others keep their
+    # last_update (and their season)
+    for change in changes:
+        if change.is_new or not change.marks_changed:
+            continue
+        student = stored[change.student.university_number]
+        stored_marks = {x.subject.name: x for x in student.subjects_marks}
+        for mark in change.updated:
+            subject_mark = stored_marks[mark.subject.name]
+            subject_mark.nazari = mark.nazari
+            subject_mark.amali = mark.amali
+            subject_mark.total = mark.total
+            subject_mark.last_update = func.now()
         student.subjects_marks.extend(
-            [SubjectMark(**mark.model_dump()) for mark in marks.values()]
+            [SubjectMark(**mark.model_dump()) for mark in change.inserted]
         )
 
+    # the students were checked against the website just now
+    if stored:
+        touch_students(session, list(stored))
+
     session.commit()
+    changed = [x for x in changes if x.marks_changed]
+    publish_changes(changed)
+    return [x.student.university_number for x in changed]
 
 
 @session_wrapper
-def insert_only_new_subjects(session: Session, subjects: List[SubjectNameCreateSchema]):
-    db_subjects = [row.name for row in get_all_subjects(session)]
+def add_subscription(
+    session: Session, telegram_id: int, university_number: int
+) -> bool:
+    stmt = select(Subscription).where(
+        Subscription.telegram_id == telegram_id,
+        Subscription.university_number == university_number,
+    )
+    if session.scalars(stmt).first():
+        return False
+    session.add(
+        Subscription(telegram_id=telegram_id, university_number=university_number)
+    )
+    return True
+
+
+@session_wrapper
+def remove_subscriptions(
+    session: Session,
+    telegram_id: int,
+    university_numbers: Optional[Iterable[int]] = None,
+) -> int:
+    """
+    remove the given subscriptions of the user, or all of them if no numbers given
+    """
+    stmt = sql_delete(Subscription).where(Subscription.telegram_id == telegram_id)
+    if university_numbers is not None:
+        stmt = stmt.where(Subscription.university_number.in_(university_numbers))
+    return session.execute(stmt).rowcount
+
+
+@session_wrapper
+def get_user_subscriptions(session: Session, telegram_id: int) -> List[int]:
+    stmt = (
+        select(Subscription.university_number)
+        .where(Subscription.telegram_id == telegram_id)
+        .order_by(Subscription.university_number)
+    )
+    return session.scalars(stmt).all()
+
+
+@session_wrapper
+def get_subscribers(
+    session: Session, university_numbers: Iterable[int]
+) -> Dict[int, List[int]]:
+    stmt = select(Subscription.university_number, Subscription.telegram_id).where(
+        Subscription.university_number.in_(university_numbers)
+    )
+    subscribers = {}
+    for number, telegram_id in session.execute(stmt):
+        subscribers.setdefault(number, []).append(telegram_id)
+    return subscribers
+
+
+@session_wrapper
+def get_stale_subscribed_numbers(
+    session: Session, older_than: datetime, limit: int
+) -> List[int]:
+    """the subscribed numbers that aren't stored or haven't been updated since
+    `older_than`, the never fetched and then the stalest first
+    """
+    stmt = (
+        select(Subscription.university_number)
+        .outerjoin(Student, Student.university_number == Subscription.university_number)
+        .where(or_(Student.id.is_(None), Student.last_update < older_than))
+        .group_by(Subscription.university_number)
+        .order_by(func.min(Student.last_update).nulls_first())
+        .limit(limit)
+    )
+    return list(session.scalars(stmt).all())
+
 
-    to_insert = [
-        SubjectName(name=x.name) for x in subjects if x.name not in db_subjects
+@session_wrapper
+def create_crawl_shards(
+    session: Session, start_number: int, end_number: int, shard_size: int
+) -> int:
+    """
+    split the range into shards, the existing ones are kept with their progress
+    and the failed ones are pending again
+    """
+    session.execute(
+        update(CrawlShard)
+        .where(CrawlShard.status == "failed")
+        .values(status="pending", attempts=0)
+    )
+    existing = set(
+        session.execute(select(CrawlShard.start_number, CrawlShard.end_number)).all()
+    )
+    shards = [
+        CrawlShard(start_number=x, end_number=min(x + shard_size - 1, end_number))
+        for x in range(start_number, end_number + 1, shard_size)
+        if (x, min(x + shard_size - 1, end_number)) not in existing
     ]
-    session.add_all(to_insert)
+    session.add_all(shards)
+    return len(shards)
+
+
+def _claimable(now: datetime):
+    # a released shard keeps its lease expiry as the time it may be retried
+    return or_(
+        (CrawlShard.status == "pending") & CrawlShard.lease_expires_at.is_(None),
+        CrawlShard.status.in_(["pending", "leased"])
+        & (CrawlShard.lease_expires_at < now),
+    )
+
+
+@session_wrapper
+def claim_crawl_shard(
+    session: Session, worker: str, lease_duration: float
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    lease a pending (or an expired) shard to the worker, the update only succeeds
+    if no other worker claimed the shard in the meantime
+
+    returns the (id, start_number, end_number, attempts) of the shard or None
+    """
+    now = datetime.now()
+    candidates = session.execute(
+        select(
+            CrawlShard.id,
+            CrawlShard.start_number,
+            CrawlShard.end_number,
+            CrawlShard.attempts,
+        )
+        .where(_claimable(now))
+        .order_by(CrawlShard.start_number)
+        .limit(10)
+    ).all()
+    for shard_id, start_number, end_number, attempts in candidates:
+        stmt = (
+            update(CrawlShard)
+            .where(CrawlShard.id == shard_id, _claimable(now))
+            .values(
+                status="leased",
+                worker=worker,
+                lease_expires_at=now + timedelta(seconds=lease_duration),
+                attempts=CrawlShard.attempts + 1,
+            )
+        )
+        if session.execute(stmt).rowcount == 1:
+            return shard_id, start_number, end_number, attempts + 1
+    return None
+
+
+@session_wrapper
+def renew_crawl_shard(
+    session: Session, shard_id: int, worker: str, lease_duration: float
+) -> bool:
+    stmt = (
+        update(CrawlShard)
+        .where(
+            CrawlShard.id == shard_id,
+            CrawlShard.worker == worker,
+            CrawlShard.status == "leased",
+        )
+        .values(lease_expires_at=datetime.now() + timedelta(seconds=lease_duration))
+    )
+    return session.execute(stmt).rowcount == 1
+
+
+@session_wrapper
+def release_crawl_shard(
+    session: Session, shard_id: int, worker: str, retry_after: float
+) -> bool:
+    """give the shard back as pending, any worker can claim it again after
+    `retry_after` seconds
+    """
+    stmt = (
+        update(CrawlShard)
+        .where(
+            CrawlShard.id == shard_id,
+            CrawlShard.worker == worker,
+            CrawlShard.status == "leased",
+        )
+        .values(
+            status="pending",
+            worker=None,
+            lease_expires_at=datetime.now() + timedelta(seconds=retry_after),
+        )
+    )
+    return session.execute(stmt).rowcount == 1
+
+
+@session_wrapper
+def complete_crawl_shard(
+    session: Session, shard_id: int, worker: str, fetched: int, failed: int
+) -> bool:
+    """a shard is only done when none of its numbers failed, otherwise it's kept
+    as failed with the failures count until the next run
+    """
+    stmt = (
+        update(CrawlShard)
+        .where(CrawlShard.id == shard_id, CrawlShard.worker == worker)
+        .values(
+            status="failed" if failed else "done",
+            lease_expires_at=None,
+            fetched=fetched,
+            failed=failed,
+        )
+    )
+    return session.execute(stmt).rowcount == 1
+
+
+@session_wrapper
+def get_crawl_shards_progress(session: Session) -> Dict[str, int]:
+    stmt = select(CrawlShard.status, func.count()).group_by(CrawlShard.status)
+    return dict(session.execute(stmt).all())
+
+
+@session_wrapper
+def reset_crawl_shards(session: Session):
+    session.execute(sql_delete(CrawlShard))
+
+
+@session_wrapper
+def insert_only_new_subjects(session: Session, subjects: List[SubjectNameCreateSchema]):
+    db_subjects = {row.name for row in get_all_subjects(session)}
+
+    # another process may insert the same subject after it was read, every new
+    # subject gets a savepoint so that duplicate is skipped instead of failing
+    for subject in subjects:
+        if subject.name in db_subjects:
+            continue
+        try:
+            with session.begin_nested():
+                session.add(SubjectName(name=subject.name))
+        except IntegrityError:
+            pass
     session.commit()
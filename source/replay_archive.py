@@ -0,0 +1,77 @@
+"""replay the raw pages archive through the parser and into the database,
+useful after fixing a bug in `extract_data` (no request is sent to the website)
+
+usage (from the project root, like the bot itself):
+    python source/replay_archive.py ARCHIVE_DIR [--since UNIX_TIMESTAMP] [--dry-run]
+"""
+
+import argparse
+import logging
+import time
+
+from constants import PERSIST_BATCH_SIZE
+from helpers import init_database
+from html_parser import extract_data
+from page_archive import iter_archive
+from queries import update_or_insert_students_data
+from schemas import StudentCreate
+from web_scrapper import WebStudentResponse
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def replay(
+    directory: str,
+    since: float = 0,
+    batch_size: int = PERSIST_BATCH_SIZE,
+    dry_run: bool = False,
+):
+    bot_data = {}
+    if not dry_run:
+        init_database(bot_data)
+    # a batch can't hold the same student twice, the latest page wins
+    batch: dict[int, StudentCreate] = {}
+    pages, start = 0, time.time()
+
+    def flush():
+        if batch and not dry_run:
+            with bot_data["db_session"]() as session:
+                update_or_insert_students_data(session, list(batch.values()))
+        batch.clear()
+
+    for number, fetched_at, page in iter_archive(directory):
+        if fetched_at < since:
+            continue
+        batch[number] = extract_data(WebStudentResponse(number, page))
+        pages += 1
+        if len(batch) >= batch_size:
+            flush()
+        if pages % 10000 == 0:
+            logger.info("%d pages, %.0f pages/s", pages, pages / (time.time() - start))
+    flush()
+    elapsed = time.time() - start
+    logger.info(
+        "replayed %d pages in %.2fs (%.0f pages/s)",
+        pages,
+        elapsed,
+        pages / max(elapsed, 1e-9),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="the PAGE_ARCHIVE_DIR to replay")
+    parser.add_argument("--since", type=float, default=0, help="skip older pages")
+    parser.add_argument("--batch-size", type=int, default=PERSIST_BATCH_SIZE)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only parse, don't write to the db"
+    )
+    args = parser.parse_args()
+    replay(args.directory, args.since, args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Generic, Optional, TypeVar
+
+from page_fingerprint import PageFingerprint
+
+T = TypeVar("T")
+
+
+@dataclass
+class CacheEntry(Generic[T]):
+    value: T
+    fingerprint: PageFingerprint
+    fetched_at: float
+
+
+class ResponseCache(Generic[T]):
+    """LRU cache of recently fetched pages keyed by student number.
+
+    an entry is served for `ttl` seconds, but it's kept (until evicted) after
+    that, so the next fetch of the same student can be compared with it.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, CacheEntry[T]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, number: int) -> Optional[T]:
+        entry = self._entries.get(number)
+        if entry is None or time.monotonic() - entry.fetched_at > self.ttl:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(number)
+        self.hits += 1
+        return entry.value
+
+    def put(self, number: int, value: T, fingerprint: PageFingerprint) -> bool:
+        """store the value, returns True when its content is the same as the
+        previously stored one for this number
+        """
+        previous = self._entries.pop(number, None)
+        self._entries[number] = CacheEntry(value, fingerprint, time.monotonic())
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return previous is not None and previous.fingerprint == fingerprint
@@ -0,0 +1,98 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import FrozenSet
+
+import aiohttp
+
+# network level failures that are worth another attempt, anything else is a bug
+RETRYABLE_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class DeadlineExceededError(UpstreamError):
+    pass
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    exception_base_delay: float = 0.5
+    status_base_delay: float = 1.0
+    max_delay: float = 10.0
+    retry_statuses: FrozenSet[int] = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+    def should_retry_status(self, status: int) -> bool:
+        return status in self.retry_statuses
+
+    def should_retry_exception(self, exc: BaseException) -> bool:
+        return isinstance(exc, RETRYABLE_EXCEPTIONS)
+
+    def exception_delay(self, attempt: int) -> float:
+        return self._full_jitter(self.exception_base_delay, attempt)
+
+    def status_delay(self, attempt: int) -> float:
+        # the site answered but it's overloaded, so back off harder
+        return self._full_jitter(self.status_base_delay, attempt)
+
+    def _full_jitter(self, base: float, attempt: int) -> float:
+        # a random delay in [0, cap] keeps thousands of retries from syncing up
+        return random.uniform(0, min(self.max_delay, base * 2**attempt))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 20, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = self.CLOSED
+
+    @property
+    def state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.recovery_timeout
+        ):
+            return self.HALF_OPEN
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    @property
+    def consecutive_failures(self) -> int:
+        return self._failures
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            # let a single probe through, the next one waits another timeout
+            self._opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self._failures = 0
+        self._state = self.CLOSED
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == self.OPEN or self._failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
@@ -0,0 +1,99 @@
+import asyncio
+import heapq
+import itertools
+from collections import Counter
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import List, Tuple
+
+from concurrency_controller import AIMDController
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    INLINE_REFRESH = 1
+    DANGER = 2
+    BULK = 3
+
+
+class PriorityScheduler:
+    """hands out the controller's upstream slots by priority, a waiting user
+    request always goes before queued crawl work. bulk requests can't use the last
+    `bulk_reserve` slots of the window, so some capacity is kept for users.
+    """
+
+    def __init__(self, controller: AIMDController, bulk_reserve: int):
+        self.controller = controller
+        self.bulk_reserve = bulk_reserve
+        self._in_use = 0
+        self._in_use_by_priority: Counter = Counter()
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        controller.on_grow = self._wake_waiters
+
+    def _capacity(self, priority: Priority) -> int:
+        limit = self.controller.limit
+        if priority == Priority.BULK:
+            return max(1, limit - self.bulk_reserve)
+        return limit
+
+    async def acquire(self, priority: Priority):
+        if not self._heap and self._in_use < self._capacity(priority):
+            self._grant(priority)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._counter), waiter))
+        # the queued waiters may be blocked by their own class' capacity only
+        self._wake_waiters()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed to us right before the cancellation
+                self.release(priority)
+            raise
+
+    def release(self, priority: Priority):
+        self._in_use -= 1
+        self._in_use_by_priority[priority] -= 1
+        self._wake_waiters()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def _grant(self, priority: Priority):
+        self._in_use += 1
+        self._in_use_by_priority[priority] += 1
+
+    def _wake_waiters(self):
+        while self._heap:
+            priority, _, waiter = self._heap[0]
+            if waiter.done():  # cancelled while waiting
+                heapq.heappop(self._heap)
+                continue
+            if self._in_use >= self._capacity(priority):
+                break
+            heapq.heappop(self._heap)
+            self._grant(priority)
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        waiting = Counter(
+            Priority(priority).name.lower()
+            for priority, _, waiter in self._heap
+            if not waiter.done()
+        )
+        return {
+            "in_use": self._in_use,
+            "in_use_by_priority": {
+                Priority(x).name.lower(): cnt
+                for x, cnt in self._in_use_by_priority.items()
+                if cnt
+            },
+            "waiting": dict(waiting),
+        }
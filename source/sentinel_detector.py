@@ -0,0 +1,134 @@
+import logging
+from collections import deque
+from dataclasses import asdict
+from typing import Deque, Dict, List, Set
+
+from constants import SENTINEL_COHORT_SIZE, SENTINELS_PER_COHORT
+from crawler import CrawlStats, crawl_numbers
+from helpers import get_session
+from html_parser import extract_data
+from number_index import number_index
+from queries import get_marks_counts, update_or_insert_students_data
+from scheduler import Priority
+from sqlalchemy.orm import Session, sessionmaker
+from telegram.ext import ContextTypes
+from web_scrapper import FailedStudentResponse, exam_site_breaker, iter_async_request
+
+logger = logging.getLogger(__name__)
+
+
+class SentinelDetector:
+    """probes a few known students (sentinels) of every cohort of numbers, when
+    the page of one of them has more marks rows than the marks stored for it a
+    new subject was published, so only the numbers of that cohort are swept.
+    the baseline is the database, a restart doesn't hide a publication.
+    """
+
+    def __init__(self, cohort_size: int, sentinels_per_cohort: int):
+        self.cohort_size = cohort_size
+        self.sentinels_per_cohort = sentinels_per_cohort
+        self.detections = 0
+        self.last_sweep = CrawlStats()
+        self.sentinels = 0
+        # the rows count that already triggered a sweep, a page the stored marks
+        # can't match (a repeated subject) is swept once instead of every probe
+        self._swept_rows: Dict[int, int] = {}
+        self._sweep_queue: Deque[int] = deque()
+        self._queued: Set[int] = set()
+        self._is_running = False
+
+    def cohort_of(self, number: int) -> int:
+        return number - number % self.cohort_size
+
+    def cohort_numbers(self, cohort: int) -> List[int]:
+        return list(number_index.iter_valid(cohort, cohort + self.cohort_size - 1))
+
+    def pick_sentinels(self) -> List[int]:
+        cohorts: Dict[int, List[int]] = {}
+        for number in number_index.iter_valid():
+            cohorts.setdefault(self.cohort_of(number), []).append(number)
+
+        # spread the sentinels over the cohort, the same ones are probed between
+        # runs as long as the index doesn't change
+        sentinels = []
+        for numbers in cohorts.values():
+            step = max(1, len(numbers) // self.sentinels_per_cohort)
+            sentinels.extend(numbers[::step][: self.sentinels_per_cohort])
+        return sentinels
+
+    def schedule_sweep(self, cohort: int):
+        if cohort not in self._queued:
+            self._queued.add(cohort)
+            self._sweep_queue.append(cohort)
+
+    async def probe(self, Session: sessionmaker[Session]) -> List[int]:
+        sentinels = self.pick_sentinels()
+        self.sentinels = len(sentinels)
+        marks_counts = get_marks_counts(Session, sentinels)
+        detected = []
+        changed_students = []
+        async for result in iter_async_request(
+            sentinels, priority=Priority.BULK, fresh=True
+        ):
+            if isinstance(result, FailedStudentResponse):
+                continue
+            number = result.student_number
+            # the name row and the header row come before the marks rows
+            rows = result.fingerprint.rows - 2
+            if rows <= marks_counts.get(number, 0):
+                self._swept_rows.pop(number, None)
+                continue
+            if self._swept_rows.get(number) == rows:
+                continue
+            self._swept_rows[number] = rows
+
+            # the sweep will hit the cached page of the sentinel, so save it now
+            changed_students.append(extract_data(result))
+            cohort = self.cohort_of(number)
+            if cohort not in detected:
+                detected.append(cohort)
+
+        if changed_students:
+            with Session() as session:
+                update_or_insert_students_data(session, changed_students)
+        for cohort in detected:
+            logger.info("new marks detected for the cohort %s", cohort)
+            self.detections += 1
+            self.schedule_sweep(cohort)
+        return detected
+
+    async def sweep(self, Session: sessionmaker[Session]):
+        while self._sweep_queue:
+            cohort = self._sweep_queue.popleft()
+            self._queued.discard(cohort)
+            self.last_sweep = await crawl_numbers(
+                Session, self.cohort_numbers(cohort), Priority.BULK
+            )
+
+    async def run_once(self, Session: sessionmaker[Session]):
+        if self._is_running or exam_site_breaker.is_open:
+            return
+        self._is_running = True
+        try:
+            await self.probe(Session)
+            await self.sweep(Session)
+        finally:
+            self._is_running = False
+
+    def stats(self) -> dict:
+        return {
+            "sentinels": self.sentinels,
+            "detections": self.detections,
+            "queued_sweeps": len(self._sweep_queue),
+            "last_sweep": asdict(self.last_sweep),
+        }
+
+
+sentinel_detector = SentinelDetector(SENTINEL_COHORT_SIZE, SENTINELS_PER_COHORT)
+
+
+async def probe_sentinels(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await sentinel_detector.run_once(get_session(context))
+    except Exception:
+        logger.exception("sentinels probe failed")
@@ -0,0 +1,190 @@
+"""crawl a range of student numbers with several worker processes, the range is
+split into shards that the workers lease from the database, a shard whose worker
+died is handed to another worker once its lease expires
+
+usage (from the project root, like the bot itself):
+    python source/shard_worker.py START END [--workers N] [--shard-size SIZE]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import web_scrapper
+from constants import HTTP_LIMIT_PER_HOST, SHARD_POLL_INTERVAL
+from crawler import CrawlStats, crawl_numbers
+from helpers import init_database
+from parse_pool import parse_pool
+from queries import (
+    claim_crawl_shard,
+    complete_crawl_shard,
+    create_crawl_shards,
+    get_crawl_shards_progress,
+    release_crawl_shard,
+    renew_crawl_shard,
+    reset_crawl_shards,
+)
+from scheduler import Priority
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+async def keep_lease(Session, shard_id: int, worker: str, lease_duration: float):
+    while True:
+        await asyncio.sleep(lease_duration / 3)
+        if not renew_crawl_shard(Session, shard_id, worker, lease_duration):
+            logger.warning("%s lost the lease of the shard %d", worker, shard_id)
+            return
+
+
+async def run_worker(
+    worker: str, concurrency: int, lease_duration: float, max_attempts: int
+):
+    bot_data = {}
+    init_database(bot_data)
+    Session = bot_data["db_session"]
+
+    # every process has its own upstream budget
+    web_scrapper.set_upstream_budget(concurrency)
+    # segments of the raw pages archive can't be shared between processes
+    web_scrapper.page_archive = None
+    # the workers are already one process per core
+    parse_pool.max_workers = 0
+    await web_scrapper.init_http_session(limit=concurrency, limit_per_host=concurrency)
+    try:
+        while True:
+            shard = claim_crawl_shard(Session, worker, lease_duration)
+            if shard is None:
+                progress = get_crawl_shards_progress(Session)
+                if not progress.get("leased") and not progress.get("pending"):
+                    break
+                # other workers hold the remaining shards, one of them may be
+                # released or its lease may expire
+                await asyncio.sleep(SHARD_POLL_INTERVAL)
+                continue
+
+            shard_id, start_number, end_number, attempts = shard
+            logger.info("%s crawling %d-%d", worker, start_number, end_number)
+            lease_task = asyncio.create_task(
+                keep_lease(Session, shard_id, worker, lease_duration)
+            )
+            try:
+                stats = await crawl_numbers(
+                    Session, range(start_number, end_number + 1), Priority.BULK
+                )
+            except Exception:
+                # a database error, the whole shard counts as failed
+                logger.exception(
+                    "%s failed to crawl %d-%d", worker, start_number, end_number
+                )
+                stats = CrawlStats(failed=end_number - start_number + 1)
+            finally:
+                lease_task.cancel()
+            if stats.failed and attempts < max_attempts:
+                # the whole shard is retried later (by any worker), after its
+                # last attempt it's left as failed
+                logger.warning(
+                    "%s failed to crawl %d numbers of %d-%d (attempt %d/%d)",
+                    worker,
+                    stats.failed,
+                    start_number,
+                    end_number,
+                    attempts,
+                    max_attempts,
+                )
+                release_crawl_shard(Session, shard_id, worker, lease_duration / 3)
+                continue
+            complete_crawl_shard(
+                Session,
+                shard_id,
+                worker,
+                stats.updated + stats.no_changes,
+                stats.failed,
+            )
+            logger.info(
+                "%s finished %d-%d in %.1fs "
+                "(%d updated, %d without changes, %d failed)",
+                worker,
+                start_number,
+                end_number,
+                stats.elapsed,
+                stats.updated,
+                stats.no_changes,
+                stats.failed,
+            )
+    finally:
+        await web_scrapper.close_http_session()
+
+
+def worker_process(
+    index: int, concurrency: int, lease_duration: float, max_attempts: int
+):
+    worker = "{}-{}-{}".format(socket.gethostname(), os.getpid(), index)
+    asyncio.run(run_worker(worker, concurrency, lease_duration, max_attempts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("start", type=int)
+    parser.add_argument("end", type=int)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=1000)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=HTTP_LIMIT_PER_HOST,
+        help="max in flight requests per worker",
+    )
+    parser.add_argument("--lease", type=float, default=300, help="lease seconds")
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="attempts before a shard with failed numbers is left as failed",
+    )
+    parser.add_argument(
+        "--reset", action="store_true", help="forget the progress of older crawls"
+    )
+    args = parser.parse_args()
+
+    bot_data = {}
+    init_database(bot_data)
+    Session = bot_data["db_session"]
+    if args.reset:
+        reset_crawl_shards(Session)
+    created = create_crawl_shards(Session, args.start, args.end, args.shard_size)
+    logger.info(
+        "%d new shards, progress: %s", created, get_crawl_shards_progress(Session)
+    )
+    # the workers open their own connections
+    Session.kw["bind"].dispose()
+
+    start = time.time()
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=worker_process,
+            args=(i, args.concurrency, args.lease, args.max_attempts),
+        )
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    logger.info(
+        "finished in %.1fs, progress: %s",
+        time.time() - start,
+        get_crawl_shards_progress(Session),
+    )
+
+
+if __name__ == "__main__":
+    main()
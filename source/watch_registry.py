@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from constants import (
+    AIMD_MAX_ERROR_RATE,
+    DANGER_MAX_POLL_INTERVAL,
+    DANGER_NUMBERS_PER_POLL,
+    DANGER_POLL_INTERVAL,
+)
+from lookup_coordinator import lookup_coordinator
+from page_fingerprint import PageFingerprint
+from scheduler import Priority
+from web_scrapper import (
+    FailedStudentResponse,
+    WebStudentResponse,
+    concurrency_controller,
+    exam_site_breaker,
+)
+
+logger = logging.getLogger(__name__)
+
+OnChange = Callable[[WebStudentResponse, List[int]], Awaitable]
+OnExpire = Callable[[int, List[int]], Awaitable]
+
+
+@dataclass
+class Subscriber:
+    # fingerprint of the page when the user subscribed, None if it's not known
+    baseline: Optional[PageFingerprint]
+    expires_at: float
+
+
+@dataclass
+class Watch:
+    subscribers: Dict[int, Subscriber] = field(default_factory=dict)
+
+
+class WatchRegistry:
+    """one polling loop for all the danger mode users, every watched number is
+    fetched once per interval whatever the number of its subscribers is, and the
+    result is sent to all of them.
+    """
+
+    def __init__(
+        self, base_interval: float, max_interval: float, numbers_per_poll: int
+    ):
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.numbers_per_poll = numbers_per_poll
+        self.on_change: Optional[OnChange] = None
+        self.on_expire: Optional[OnExpire] = None
+        self._watches: Dict[int, Watch] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._watches)
+
+    @property
+    def subscribers_count(self) -> int:
+        return sum(len(x.subscribers) for x in self._watches.values())
+
+    def subscribe(
+        self,
+        number: int,
+        user_id: int,
+        baseline: Optional[PageFingerprint],
+        duration: float,
+    ):
+        self.unsubscribe(user_id)
+        watch = self._watches.setdefault(number, Watch())
+        watch.subscribers[user_id] = Subscriber(baseline, time.monotonic() + duration)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def unsubscribe(self, user_id: int) -> bool:
+        for number, watch in list(self._watches.items()):
+            if watch.subscribers.pop(user_id, None) is not None:
+                if not watch.subscribers:
+                    del self._watches[number]
+                return True
+        return False
+
+    def is_watching(self, user_id: int) -> bool:
+        return any(user_id in x.subscribers for x in self._watches.values())
+
+    def interval(self) -> float:
+        # stretch the interval when there's many numbers to poll or the site struggles
+        interval = self.base_interval * max(
+            1, len(self._watches) / self.numbers_per_poll
+        )
+        if exam_site_breaker.is_open or (
+            concurrency_controller.error_rate > AIMD_MAX_ERROR_RATE
+        ):
+            interval *= 2
+        elif (
+            concurrency_controller.latency_ewma > concurrency_controller.target_latency
+        ):
+            interval *= 1.5
+        return min(interval, self.max_interval)
+
+    async def _run(self):
+        while self._watches:
+            await asyncio.sleep(self.interval())
+            try:
+                await self._expire()
+                await self._poll()
+            except Exception:
+                logger.exception("danger mode polling failed")
+
+    async def _expire(self):
+        now = time.monotonic()
+        for number, watch in list(self._watches.items()):
+            expired = [
+                user_id
+                for user_id, subscriber in watch.subscribers.items()
+                if subscriber.expires_at <= now
+            ]
+            for user_id in expired:
+                del watch.subscribers[user_id]
+            if not watch.subscribers:
+                del self._watches[number]
+            if expired and self.on_expire:
+                await self.on_expire(number, expired)
+
+    async def _poll(self):
+        async for result in lookup_coordinator.iter_fetch(
+            list(self._watches), priority=Priority.DANGER
+        ):
+            watch = self._watches.get(result.student_number)
+            if isinstance(result, FailedStudentResponse) or watch is None:
+                continue
+
+            # a corrected mark changes the fingerprint as much as a new one does
+            notified = []
+            for user_id, subscriber in watch.subscribers.items():
+                if subscriber.baseline is None:
+                    subscriber.baseline = result.fingerprint
+                elif subscriber.baseline != result.fingerprint:
+                    notified.append(user_id)
+            for user_id in notified:
+                del watch.subscribers[user_id]
+            if not watch.subscribers:
+                del self._watches[result.student_number]
+            if notified and self.on_change:
+                await self.on_change(result, notified)
+
+
+watch_registry = WatchRegistry(
+    DANGER_POLL_INTERVAL, DANGER_MAX_POLL_INTERVAL, DANGER_NUMBERS_PER_POLL
+)
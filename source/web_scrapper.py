@@ -1,43 +1,378 @@
 import asyncio
-from dataclasses import dataclass
-from typing import List
+import time
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple, Union
 
 import aiohttp
+from concurrency_controller import AIMDController
+from constants import (
+    AIMD_INITIAL_WINDOW,
+    AIMD_MAX_ERROR_RATE,
+    AIMD_MAX_WINDOW,
+    AIMD_MIN_WINDOW,
+    AIMD_TARGET_LATENCY,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RECOVERY_TIMEOUT,
+    HEDGE_MIN_DELAY,
+    HEDGE_REQUESTS,
+    HTTP_CONNECTOR_LIMIT,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_LIMIT_PER_HOST,
+    INCREMENTAL_PARSING,
+    PARSE_CHUNK_SIZE,
+    REQUEST_ATTEMPT_TIMEOUT,
+    REQUEST_DEADLINE_BULK,
+    REQUEST_DEADLINE_DANGER,
+    REQUEST_DEADLINE_INLINE_REFRESH,
+    REQUEST_DEADLINE_INTERACTIVE,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    SCHEDULER_BULK_RESERVE,
+    UNIVERSITY_URL,
+)
+from egress_pool import egress_pool
+from page_archive import page_archive
+from page_fingerprint import PageFingerprint, page_fingerprint
+from page_parser import IncrementalPageParser
+from response_cache import ResponseCache
+from retry_policy import (
+    RETRYABLE_EXCEPTIONS,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceededError,
+    RetryPolicy,
+    UpstreamError,
+)
+from scheduler import Priority, PriorityScheduler
+from schemas import StudentCreate
 
-UNIVERSITY_URL = "https://exam.homs-univ.edu.sy/exam-it/re.php"
+_http_session: Optional[aiohttp.ClientSession] = None
+
+# shared by every request, handlers check it to fall back to the stored marks
+exam_site_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RECOVERY_TIMEOUT)
+concurrency_controller = AIMDController(
+    AIMD_INITIAL_WINDOW,
+    AIMD_MIN_WINDOW,
+    AIMD_MAX_WINDOW,
+    AIMD_TARGET_LATENCY,
+    AIMD_MAX_ERROR_RATE,
+)
+request_scheduler = PriorityScheduler(concurrency_controller, SCHEDULER_BULK_RESERVE)
+
+REQUEST_DEADLINES = {
+    Priority.INTERACTIVE: REQUEST_DEADLINE_INTERACTIVE,
+    Priority.INLINE_REFRESH: REQUEST_DEADLINE_INLINE_REFRESH,
+    Priority.DANGER: REQUEST_DEADLINE_DANGER,
+    Priority.BULK: REQUEST_DEADLINE_BULK,
+}
+# a user is waiting on these, the others can afford the tail latency
+HEDGED_PRIORITIES = {Priority.INTERACTIVE, Priority.INLINE_REFRESH}
+hedge_stats = {"sent": 0, "won": 0}
 
 
 @dataclass
 class WebStudentResponse:
     student_number: int
     html_page: bytes
+    fingerprint: Optional[PageFingerprint] = None
+    # the page is the same as the last one this process fetched for the number,
+    # that doesn't mean it has been saved
+    is_unchanged: bool = False
+    # the student parsed while the page was downloading
+    parsed: Optional[StudentCreate] = None
+
+
+@dataclass
+class FailedStudentResponse:
+    student_number: int
+    error: BaseException
+
+
+response_cache: ResponseCache[WebStudentResponse] = ResponseCache(
+    RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+)
+
+
+async def init_http_session(
+    limit: int = HTTP_CONNECTOR_LIMIT, limit_per_host: int = HTTP_LIMIT_PER_HOST
+) -> aiohttp.ClientSession:
+    """create the process-wide session, keep-alive connections are reused
+    between requests and the connector caps the sockets opened to the exam site
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        _http_session = aiohttp.ClientSession(connector=connector)
+    if egress_pool is not None:
+        await egress_pool.open()
+        # every route brings its own budget
+        concurrency_controller.max_window = max(
+            concurrency_controller.max_window, egress_pool.capacity
+        )
+    return _http_session
+
+
+def set_upstream_budget(max_window: int, bulk_reserve: int = 0):
+    """resize the concurrency window of this process, the standalone crawlers
+    have no user traffic to keep slots for
+    """
+    concurrency_controller.max_window = max_window
+    concurrency_controller.min_window = min(
+        concurrency_controller.min_window, max_window
+    )
+    concurrency_controller.window = min(concurrency_controller.window, max_window)
+    request_scheduler.bulk_reserve = bulk_reserve
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+    if egress_pool is not None:
+        await egress_pool.close()
 
 
-async def multi_async_request(
-    numbers: List[int], recurse_limit: int = 2
-) -> List[WebStudentResponse]:
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            asyncio.create_task(one_req(int(number), session, recurse_limit))
-            for number in numbers
-        ]
-        gathered = await asyncio.gather(*tasks)
-    return gathered
+async def get_http_session() -> aiohttp.ClientSession:
+    if _http_session is None or _http_session.closed:
+        return await init_http_session()
+    return _http_session
+
+
+async def iter_async_request(
+    numbers: Iterable[int],
+    recurse_limit: int = 2,
+    priority: Priority = Priority.INTERACTIVE,
+    max_in_flight: int = HTTP_CONNECTOR_LIMIT,
+    fresh: bool = False,
+) -> AsyncIterator[Union[WebStudentResponse, FailedStudentResponse]]:
+    """yield every response as soon as it arrives (in completion order), a failed
+    number is yielded as `FailedStudentResponse` instead of failing the batch.
+    at most `max_in_flight` requests are pending, so pages don't pile up in memory.
+    `fresh` skips the response cache, see `cached_one_req`
+    """
+    session = await get_http_session()
+    numbers = iter(numbers)
+    pending: Dict[asyncio.Task, int] = {}
+    try:
+        while True:
+            while len(pending) < max_in_flight:
+                number = next(numbers, None)
+                if number is None:
+                    break
+                task = asyncio.create_task(
+                    cached_one_req(int(number), session, recurse_limit, priority, fresh)
+                )
+                pending[task] = int(number)
+            if not pending:
+                return
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                number = pending.pop(task)
+                error = task.exception()
+                if error is not None:
+                    yield FailedStudentResponse(number, error)
+                else:
+                    yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def cached_one_req(
+    number: int,
+    session: aiohttp.ClientSession,
+    recurse_limit: int,
+    priority: Priority = Priority.INTERACTIVE,
+    fresh: bool = False,
+) -> WebStudentResponse:
+    """the cached page is returned if it's recent enough, unless it's `fresh` or
+    a danger poll: those compare pages over time so they always ask the website,
+    the cache entry is still refreshed with their answer
+    """
+    if not fresh and priority != Priority.DANGER:
+        cached = response_cache.get(number)
+        if cached is not None:
+            return replace(cached, is_unchanged=True)
+    response = await one_req(number, session, recurse_limit, priority)
+    response.fingerprint = page_fingerprint(response.html_page)
+    response.is_unchanged = response_cache.put(number, response, response.fingerprint)
+    if page_archive is not None and not response.is_unchanged:
+        page_archive.append(number, response.html_page)
+    return response
 
 
 async def one_req(
-    number, session: aiohttp.ClientSession, recurse_limit: int
+    number,
+    session: aiohttp.ClientSession,
+    recurse_limit: int,
+    priority: Priority = Priority.INTERACTIVE,
+    policy: Optional[RetryPolicy] = None,
+    deadline: Optional[float] = None,
 ) -> WebStudentResponse:
-    if recurse_limit <= 0:
-        raise Exception("uncompleted request, try again later")
+    """`deadline` is an absolute `loop.time()`, by default it's derived from the
+    priority, queueing, every attempt and the backoff sleeps all count against it.
+    bulk requests have no overall deadline, every attempt gets its own one once
+    it has a slot, so a long queue of crawl work doesn't expire while waiting
+    """
+    if policy is None:
+        policy = RetryPolicy(max_attempts=recurse_limit)
+    loop = asyncio.get_running_loop()
+    if deadline is None and priority != Priority.BULK:
+        deadline = loop.time() + REQUEST_DEADLINES[priority]
+
+    for attempt in range(policy.max_attempts):
+        if not exam_site_breaker.allow_request():
+            raise CircuitOpenError("the exam site is not responding, try again later")
+        try:
+            status, res_data, parsed = await hedged_attempt(
+                number, session, priority, deadline
+            )
+        except Exception as e:
+            if not policy.should_retry_exception(e):
+                raise
+            exam_site_breaker.record_failure()
+            delay = policy.exception_delay(attempt)
+        else:
+            if status == 200:
+                exam_site_breaker.record_success()
+                return WebStudentResponse(number, res_data, parsed=parsed)
+            if not policy.should_retry_status(status):
+                raise UpstreamError(
+                    "the exam site answered {} for {}".format(status, number)
+                )
+            exam_site_breaker.record_failure()
+            delay = policy.status_delay(attempt)
+        if attempt + 1 < policy.max_attempts:
+            if deadline is not None and loop.time() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+
+    raise UpstreamError("uncompleted request, try again later")
+
+
+async def hedged_attempt(
+    number: int,
+    session: aiohttp.ClientSession,
+    priority: Priority,
+    deadline: Optional[float],
+) -> Tuple[int, bytes, Optional[StudentCreate]]:
+    """send one attempt, and if it's slower than the rolling p95 latency send a
+    duplicate one, the first usable answer wins and the other one is cancelled
+    """
+    loop = asyncio.get_running_loop()
+    primary = asyncio.create_task(single_attempt(number, session, priority, deadline))
+    hedge_delay = None
+    p95 = concurrency_controller.latency_p95
+    if HEDGE_REQUESTS and priority in HEDGED_PRIORITIES and p95 is not None:
+        hedge_delay = max(HEDGE_MIN_DELAY, p95)
+        if deadline is not None and loop.time() + hedge_delay >= deadline:
+            hedge_delay = None
+    if hedge_delay is None:
+        return await primary
+
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+        if not done:
+            hedge_stats["sent"] += 1
+            tasks.add(
+                asyncio.create_task(single_attempt(number, session, priority, deadline))
+            )
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result()[0] == 200:
+                    if task is not primary:
+                        hedge_stats["won"] += 1
+                    return task.result()
+            if not tasks:
+                # neither answer is usable, let the retry loop deal with it
+                return done.pop().result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
 
+async def single_attempt(
+    number: int,
+    session: aiohttp.ClientSession,
+    priority: Priority,
+    deadline: Optional[float],
+) -> Tuple[int, bytes, Optional[StudentCreate]]:
+    loop = asyncio.get_running_loop()
+    if deadline is None:
+        await request_scheduler.acquire(priority)
+        deadline = loop.time() + REQUEST_DEADLINES[priority]
+    else:
+        try:
+            await asyncio.wait_for(
+                request_scheduler.acquire(priority), deadline - loop.time()
+            )
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError("no free slot before the deadline") from None
+    route, route_ok, parsed = None, None, None
     try:
-        async with session.post(UNIVERSITY_URL, data={"number1": number}) as req:
-            res_data = await req.read()
-        if req.status != 200:
-            await asyncio.sleep(1)
-            return await one_req(number, session, recurse_limit - 1)
-        return WebStudentResponse(number, res_data)
-    except Exception:
-        await asyncio.sleep(1)
-        return await one_req(number, session, recurse_limit - 1)
+        if egress_pool is not None:
+            try:
+                route = await asyncio.wait_for(
+                    egress_pool.acquire(), deadline - loop.time()
+                )
+            except asyncio.TimeoutError:
+                raise DeadlineExceededError(
+                    "no egress route before the deadline"
+                ) from None
+            session = route.session
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise DeadlineExceededError("the request deadline has passed")
+        cut_by_deadline = remaining < REQUEST_ATTEMPT_TIMEOUT
+        start = time.monotonic()
+        try:
+            async with session.post(
+                UNIVERSITY_URL,
+                data={"number1": number},
+                proxy=route.proxy if route else None,
+                timeout=aiohttp.ClientTimeout(
+                    total=min(remaining, REQUEST_ATTEMPT_TIMEOUT)
+                ),
+            ) as req:
+                if (
+                    INCREMENTAL_PARSING
+                    and priority != Priority.BULK
+                    and req.status == 200
+                ):
+                    parser = IncrementalPageParser(number)
+                    chunks = []
+                    async for chunk in req.content.iter_chunked(PARSE_CHUNK_SIZE):
+                        chunks.append(chunk)
+                        parser.feed(chunk)
+                    res_data = b"".join(chunks)
+                    parsed = parser.close()
+                else:
+                    res_data = await req.read()
+        except asyncio.TimeoutError:
+            # an attempt the deadline cut before a normal answer could arrive says
+            # nothing about the exam site, a longer one is held against it
+            elapsed = time.monotonic() - start
+            if cut_by_deadline and elapsed < concurrency_controller.expected_latency:
+                raise DeadlineExceededError("the request deadline has passed") from None
+            route_ok = False
+            concurrency_controller.record(elapsed, ok=False)
+            raise
+        except RETRYABLE_EXCEPTIONS:
+            route_ok = False
+            concurrency_controller.record(time.monotonic() - start, ok=False)
+            raise
+        route_ok = req.status < 500 and req.status != 429
+        concurrency_controller.record(time.monotonic() - start, ok=route_ok)
+        return req.status, res_data, parsed
+    finally:
+        if route is not None:
+            egress_pool.release(route, route_ok)
+        request_scheduler.release(priority)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the bot import each other by name, like when it's run from source/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "source"))
@@ -0,0 +1,156 @@
+from datetime import datetime
+
+import pytest
+import queries
+from models import Base, Season, Student, SubjectName
+from queries import (
+    add_subscription,
+    claim_crawl_shard,
+    complete_crawl_shard,
+    create_crawl_shards,
+    get_all_subjects,
+    get_marks_counts,
+    get_crawl_shards_progress,
+    get_stale_students,
+    get_stale_subscribed_numbers,
+    get_students_validity,
+    insert_only_new_subjects,
+    release_crawl_shard,
+    update_or_insert_students_data,
+)
+from schemas import StudentCreate, SubjectMarkCreateSchema, SubjectNameCreateSchema
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def Session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    MySession = sessionmaker(engine)
+    with MySession() as session:
+        session.add(
+            Season(
+                season_title="test",
+                from_date=datetime(2000, 1, 1),
+                to_date=datetime(2100, 1, 1),
+            )
+        )
+        session.commit()
+    return MySession
+
+
+def make_student(number: int, name: str = "NULL", total: int = None) -> StudentCreate:
+    student = StudentCreate(name=name, university_number=number)
+    if total is not None:
+        student.subjects_marks.append(
+            SubjectMarkCreateSchema(
+                amali=0,
+                nazari=total,
+                total=total,
+                subject=SubjectNameCreateSchema(name="برمجة 1"),
+            )
+        )
+    return student
+
+
+def save(Session, students):
+    with Session() as session:
+        return update_or_insert_students_data(session, students)
+
+
+def test_a_nameless_student_with_marks_is_valid(Session):
+    save(Session, [make_student(1), make_student(2, total=70), make_student(3, "علي")])
+
+    assert sorted(get_students_validity(Session)) == [(1, False), (2, True), (3, True)]
+    stale = get_stale_students(Session, datetime(2200, 1, 1), 10)
+    assert sorted(number for number, _ in stale) == [2, 3]
+
+
+def test_the_stored_name_is_updated(Session):
+    save(Session, [make_student(1), make_student(2, "علي")])
+    save(Session, [make_student(1, "سارة"), make_student(2)])
+
+    with Session() as session:
+        names = dict(
+            session.execute(select(Student.university_number, Student.name)).all()
+        )
+    assert names == {1: "سارة", 2: "علي"}
+
+
+def test_only_changed_marks_are_reported(Session):
+    assert save(Session, [make_student(1, "علي", 50)]) == [1]
+    assert save(Session, [make_student(1, "علي", 50)]) == []
+    assert save(Session, [make_student(1, "علي", 60)]) == [1]
+
+
+def test_marks_counts_of_the_stored_students(Session):
+    save(Session, [make_student(1, "علي", 50), make_student(2, "سارة")])
+
+    assert get_marks_counts(Session, [1, 2, 3]) == {1: 1, 2: 0}
+
+
+def test_a_subject_inserted_by_another_worker_is_skipped(Session, monkeypatch):
+    read_subjects = queries.get_all_subjects
+
+    def racing_read(session):
+        subjects = read_subjects(session)
+        with Session() as other:
+            other.add(SubjectName(name="a"))
+            other.commit()
+        return subjects
+
+    monkeypatch.setattr(queries, "get_all_subjects", racing_read)
+    with Session() as session:
+        insert_only_new_subjects(
+            session,
+            [SubjectNameCreateSchema(name="a"), SubjectNameCreateSchema(name="b")],
+        )
+    monkeypatch.undo()
+
+    with Session() as session:
+        assert [x.name for x in get_all_subjects(session)] == ["a", "b"]
+
+
+def test_a_released_shard_is_claimed_again(Session):
+    create_crawl_shards(Session, 1, 10, 10)
+    shard_id, start, end, attempts = claim_crawl_shard(Session, "w1", 60)
+    assert (start, end, attempts) == (1, 10, 1)
+    assert claim_crawl_shard(Session, "w2", 60) is None
+
+    assert release_crawl_shard(Session, shard_id, "w1", 0)
+    assert claim_crawl_shard(Session, "w2", 60) == (shard_id, 1, 10, 2)
+
+
+def test_a_released_shard_waits_before_its_retry(Session):
+    create_crawl_shards(Session, 1, 10, 10)
+    shard_id, *_ = claim_crawl_shard(Session, "w1", 60)
+    release_crawl_shard(Session, shard_id, "w1", 60)
+
+    assert claim_crawl_shard(Session, "w2", 60) is None
+    assert get_crawl_shards_progress(Session) == {"pending": 1}
+
+
+def test_a_shard_with_failures_is_retried_on_the_next_run(Session):
+    create_crawl_shards(Session, 1, 20, 10)
+    first = claim_crawl_shard(Session, "w1", 60)
+    second = claim_crawl_shard(Session, "w1", 60)
+    complete_crawl_shard(Session, first[0], "w1", 10, 0)
+    complete_crawl_shard(Session, second[0], "w1", 8, 2)
+    assert get_crawl_shards_progress(Session) == {"done": 1, "failed": 1}
+
+    assert create_crawl_shards(Session, 1, 20, 10) == 0
+    assert get_crawl_shards_progress(Session) == {"done": 1, "pending": 1}
+    assert claim_crawl_shard(Session, "w1", 60) == (second[0], 11, 20, 1)
+
+
+def test_stale_subscribed_numbers_include_the_unstored_ones(Session):
+    save(Session, [make_student(1, "علي", 50), make_student(2, "سارة")])
+    for number in (1, 2, 3):
+        add_subscription(Session, 10, number)
+    add_subscription(Session, 11, 3)
+
+    # only the unstored number is stale before the students were saved
+    assert get_stale_subscribed_numbers(Session, datetime(2000, 1, 1), 10) == [3]
+    stale = get_stale_subscribed_numbers(Session, datetime(2200, 1, 1), 10)
+    assert stale[0] == 3 and sorted(stale) == [1, 2, 3]
@@ -0,0 +1,90 @@
+import asyncio
+
+from concurrency_controller import AIMDController
+from scheduler import Priority, PriorityScheduler
+
+
+def make_scheduler(window: int, bulk_reserve: int) -> PriorityScheduler:
+    controller = AIMDController(
+        initial_window=window,
+        min_window=1,
+        max_window=10,
+        target_latency=1.0,
+        max_error_rate=0.5,
+    )
+    return PriorityScheduler(controller, bulk_reserve)
+
+
+def test_interactive_goes_past_a_blocked_bulk_waiter():
+    async def run():
+        scheduler = make_scheduler(window=3, bulk_reserve=2)
+        await scheduler.acquire(Priority.BULK)
+        bulk_waiter = asyncio.create_task(scheduler.acquire(Priority.BULK))
+        await asyncio.sleep(0)
+        assert not bulk_waiter.done()
+
+        await asyncio.wait_for(scheduler.acquire(Priority.INTERACTIVE), 0.1)
+        assert scheduler.stats()["in_use_by_priority"] == {"interactive": 1, "bulk": 1}
+
+        # the reserved slots aren't for bulk work, even when they're free
+        scheduler.release(Priority.BULK)
+        await asyncio.sleep(0)
+        assert not bulk_waiter.done()
+        scheduler.release(Priority.INTERACTIVE)
+        await asyncio.wait_for(bulk_waiter, 0.1)
+
+    asyncio.run(run())
+
+
+def test_waiters_are_served_by_priority():
+    async def run():
+        scheduler = make_scheduler(window=1, bulk_reserve=0)
+        await scheduler.acquire(Priority.INTERACTIVE)
+        order = []
+
+        async def waiter(priority: Priority):
+            await scheduler.acquire(priority)
+            order.append(priority)
+
+        tasks = [
+            asyncio.create_task(waiter(x))
+            for x in (Priority.BULK, Priority.DANGER, Priority.INTERACTIVE)
+        ]
+        await asyncio.sleep(0)
+        for _ in tasks:
+            scheduler.release(Priority.INTERACTIVE)
+            await asyncio.sleep(0)
+        assert order == [Priority.INTERACTIVE, Priority.DANGER, Priority.BULK]
+
+    asyncio.run(run())
+
+
+def test_growing_window_wakes_waiters():
+    async def run():
+        scheduler = make_scheduler(window=1, bulk_reserve=0)
+        await scheduler.acquire(Priority.INTERACTIVE)
+        waiter = asyncio.create_task(scheduler.acquire(Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        while scheduler.controller.limit < 2:
+            scheduler.controller.record(0.1, ok=True)
+        await asyncio.wait_for(waiter, 0.1)
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_gives_its_slot_back():
+    async def run():
+        scheduler = make_scheduler(window=1, bulk_reserve=0)
+        await scheduler.acquire(Priority.BULK)
+        waiter = asyncio.create_task(scheduler.acquire(Priority.BULK))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        scheduler.release(Priority.BULK)
+        assert scheduler.stats()["in_use"] == 0
+        await asyncio.wait_for(scheduler.acquire(Priority.BULK), 0.1)
+
+    asyncio.run(run())